@@ -0,0 +1,332 @@
+#MÄTER API:ETS LATENS OCH GENOMSTRÖMNING
+#
+# Seeds synthetic trade/ratio databases in a temporary directory, then drives
+# /relationships, /hypotrade and /equivalents through Flask's test client and
+# through a real local HTTP server, and reports p50/p95/p99 latency and
+# requests/sec per route. Results are saved as JSON; pass --compare with an
+# earlier result file to see the change per route.
+#
+#   python benchmark_api.py --trades 100000 --types 12 --concurrency 16 --duration 5
+#   python benchmark_api.py --server gunicorn --output after.json --compare before.json
+
+import argparse
+import http.client
+import json
+import os
+import platform
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+from datetime import datetime, timedelta, timezone
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+DEFAULT_TRADES = 50000
+DEFAULT_TYPES = 8
+DEFAULT_CONCURRENCY = 8
+DEFAULT_DURATION = 5.0 # Seconds per route and mode
+DEFAULT_WARMUP = 50 # Requests per route before measuring
+SEED_SPAN_DAYS = 7 # Synthetic trades are spread over this many days back, so every window has data
+
+REAL_TICKET_TYPES = ["GBG", "MÖ", "NSA", "SSK", "VG/H", "T-Bar", "ÖG", "HK"]
+
+def ticket_types(count):
+    """The real ticket types first, then synthetic ones (TYPE08, TYPE09, ...)."""
+    return REAL_TICKET_TYPES[:count] + [f"TYPE{i:02d}" for i in range(len(REAL_TICKET_TYPES), count)]
+
+def synthetic_trades(count, types, seed=0):
+    """
+    Yields trade tuples between random pairs of types. Each type has a hidden
+    value, so the ratios converge on something consistent like real data does.
+    """
+    rng = random.Random(seed)
+    values = {ticket_type: rng.uniform(0.5, 3.0) for ticket_type in types}
+    now = datetime.now(timezone.utc)
+    for _ in range(count):
+        offered, requested = rng.sample(types, 2)
+        offered_quantity = rng.randint(1, 4)
+        requested_quantity = max(1, round(offered_quantity * values[offered] / values[requested] * rng.uniform(0.8, 1.25)))
+        timestamp = now - timedelta(seconds=rng.uniform(0, SEED_SPAN_DAYS * 86400))
+        yield (offered_quantity, offered, requested_quantity, requested, timestamp.strftime("%Y-%m-%d %H:%M:%S"))
+
+def seed_databases(trades, type_count):
+    """Fills ticket_trades.db and ticket_trades_ratios.db in the current directory."""
+    import tickettypes
+    import tradestorer
+    import ratiocalc
+
+    types = ticket_types(type_count)
+    for ticket_type in types:
+        tickettypes.register(ticket_type) # Synthetic types beyond the real eight must be known to be stored
+    started = time.perf_counter()
+    tradestorer.create_trades_table()
+    tradestorer.add_trade_entries(synthetic_trades(trades, types))
+    ratiocalc.refresh_ratios()
+    return types, time.perf_counter() - started
+
+def route_paths(types, count=200, seed=1):
+    """A fixed pool of request paths per route, cycled through by the workers."""
+    rng = random.Random(seed)
+    paths = {"relationships": ["/relationships"]}
+    paths["hypotrade"] = []
+    paths["equivalents"] = []
+    for _ in range(count):
+        offered, requested = rng.sample(types, 2)
+        paths["hypotrade"].append("/hypotrade?" + urllib.parse.urlencode(
+            {"off_t": offered, "off_a": rng.randint(1, 4), "req_t": requested, "req_a": rng.randint(1, 4)}))
+        paths["equivalents"].append("/equivalents?" + urllib.parse.urlencode(
+            {"base_type": rng.choice(types), "base_quantity": rng.randint(1, 4)}))
+    return paths
+
+def summarize(latencies, errors, elapsed):
+    latencies = sorted(latencies)
+    if len(latencies) >= 2:
+        cuts = statistics.quantiles(latencies, n=100, method="inclusive")
+        p50, p95, p99 = cuts[49], cuts[94], cuts[98]
+    else:
+        p50 = p95 = p99 = latencies[0] if latencies else 0.0
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "rps": round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+        "mean_ms": round(statistics.fmean(latencies) * 1000, 3) if latencies else 0.0,
+        "p50_ms": round(p50 * 1000, 3),
+        "p95_ms": round(p95 * 1000, 3),
+        "p99_ms": round(p99 * 1000, 3),
+    }
+
+def run_load(make_requester, paths, concurrency, duration, warmup):
+    """
+    Runs `concurrency` threads, each with its own requester, sending paths
+    round-robin for `duration` seconds after a short warmup.
+
+    make_requester() returns a function that performs one request for a path
+    and returns True on HTTP 200.
+    """
+    requester = make_requester()
+    for i in range(warmup):
+        requester(paths[i % len(paths)])
+
+    latencies = []
+    errors = 0
+    lock = threading.Lock()
+    start_barrier = threading.Barrier(concurrency + 1)
+    deadline = [0.0]
+
+    def worker(offset):
+        nonlocal errors
+        request_one = make_requester()
+        own_latencies = []
+        own_errors = 0
+        i = offset
+        start_barrier.wait()
+        while time.perf_counter() < deadline[0]:
+            started = time.perf_counter()
+            ok = request_one(paths[i % len(paths)])
+            own_latencies.append(time.perf_counter() - started)
+            if not ok:
+                own_errors += 1
+            i += 1
+        with lock:
+            latencies.extend(own_latencies)
+            errors += own_errors
+
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    deadline[0] = time.perf_counter() + duration
+    started = time.perf_counter()
+    start_barrier.wait()
+    for thread in threads:
+        thread.join()
+    return summarize(latencies, errors, time.perf_counter() - started)
+
+def test_client_requester(app):
+    def make_requester():
+        client = app.test_client()
+        def request_one(path):
+            return client.get(path).status_code == 200
+        return request_one
+    return make_requester
+
+def http_requester(port):
+    def make_requester():
+        connection = [http.client.HTTPConnection("127.0.0.1", port, timeout=30)]
+        def request_one(path):
+            try:
+                connection[0].request("GET", path)
+                response = connection[0].getresponse()
+                response.read()
+                if response.will_close:
+                    connection[0].close()
+                return response.status == 200
+            except (OSError, http.client.HTTPException):
+                connection[0].close()
+                connection[0] = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+                return False
+        return request_one
+    return make_requester
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def wait_for_port(port, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=1):
+                return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"Server on port {port} did not start within {timeout}s")
+
+class LocalServer:
+    """
+    A real HTTP server for the app on a free local port: either werkzeug's
+    threaded server in this process, or gunicorn (with gunicorn.conf.py) in a
+    subprocess, which keeps the server off the load generator's GIL.
+    """
+
+    def __init__(self, kind, app, data_dir):
+        self.kind = kind
+        self.app = app
+        self.data_dir = data_dir
+        self.port = free_port()
+        self.server = None
+        self.process = None
+
+    def __enter__(self):
+        if self.kind == "werkzeug":
+            from werkzeug.serving import make_server
+            self.server = make_server("127.0.0.1", self.port, self.app, threaded=True)
+            threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        else:
+            self.process = subprocess.Popen(
+                [sys.executable, "-m", "gunicorn", "-c", os.path.join(REPO_DIR, "gunicorn.conf.py"),
+                 "--chdir", self.data_dir, "--pythonpath", REPO_DIR,
+                 "-b", f"127.0.0.1:{self.port}", "flask_port:app"],
+                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+            )
+        wait_for_port(self.port)
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.server is not None:
+            self.server.shutdown()
+        if self.process is not None:
+            self.process.terminate()
+            self.process.wait(timeout=30)
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare(results, baseline_path):
+    """Prints the rps and p95 change per mode/route against an earlier result file."""
+    with open(baseline_path, encoding="utf-8") as file:
+        baseline = json.load(file)
+    previous = {(row["mode"], row["route"]): row for row in baseline["results"]}
+    print(f"\nCompared with {baseline_path} ({baseline['meta'].get('git_revision')}):")
+    for row in results:
+        old = previous.get((row["mode"], row["route"]))
+        if old is None:
+            continue
+        rps_change = (row["rps"] / old["rps"] - 1) * 100 if old["rps"] else 0.0
+        p95_change = (row["p95_ms"] / old["p95_ms"] - 1) * 100 if old["p95_ms"] else 0.0
+        print(f"  {row['mode']:12s} {row['route']:14s} rps {rps_change:+6.1f}%   p95 {p95_change:+6.1f}%")
+
+def _parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the trade ratio API on synthetic data.")
+    parser.add_argument("--trades", type=int, default=DEFAULT_TRADES, help="Synthetic trades to seed")
+    parser.add_argument("--types", type=int, default=DEFAULT_TYPES, help="Number of ticket types")
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY, help="Concurrent clients")
+    parser.add_argument("--duration", type=float, default=DEFAULT_DURATION, help="Seconds per route and mode")
+    parser.add_argument("--warmup", type=int, default=DEFAULT_WARMUP, help="Unmeasured requests per route")
+    parser.add_argument("--modes", default="test_client,server", help="Comma separated: test_client, server")
+    parser.add_argument("--server", choices=("werkzeug", "gunicorn"), default="werkzeug", help="Server used by the server mode")
+    parser.add_argument("--routes", default="relationships,hypotrade,equivalents")
+    parser.add_argument("--output", default="benchmark_api_results.json", help="Where to save the JSON results")
+    parser.add_argument("--compare", metavar="FILE", help="Earlier results to compare against")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = _parse_args(argv)
+    output_path = os.path.abspath(args.output)
+    baseline_path = os.path.abspath(args.compare) if args.compare else None
+    modes = [mode.strip() for mode in args.modes.split(",") if mode.strip()]
+    routes = [route.strip() for route in args.routes.split(",") if route.strip()]
+
+    # The modules use database names relative to the working directory,
+    # so seeding and serving from a temporary directory never touches real data
+    sys.path.insert(0, REPO_DIR)
+    previous_dir = os.getcwd()
+    with tempfile.TemporaryDirectory(prefix="benchmark_api_") as data_dir:
+        os.chdir(data_dir)
+        try:
+            print(f"Seeding {args.trades} trades across {args.types} ticket types in {data_dir} ...")
+            types, seed_seconds = seed_databases(args.trades, args.types)
+            print(f"Seeded in {seed_seconds:.1f}s")
+
+            from flask_port import app
+            from interact import fetch_value_matrix
+            # Query the types as the API knows them (their canonical tickettypes names)
+            paths = route_paths(fetch_value_matrix()['types'])
+            results = []
+            for mode in modes:
+                if mode == "test_client":
+                    make_requester, server = test_client_requester(app), None
+                elif mode == "server":
+                    server = LocalServer(args.server, app, data_dir).__enter__()
+                    make_requester = http_requester(server.port)
+                else:
+                    print(f"Skipping unknown mode '{mode}'")
+                    continue
+                label = mode if mode == "test_client" else f"server:{args.server}"
+                try:
+                    for route in routes:
+                        summary = run_load(make_requester, paths[route], args.concurrency, args.duration, args.warmup)
+                        results.append({"mode": label, "route": route, **summary})
+                        print(f"  {label:16s} {route:14s} {summary['rps']:9.1f} req/s  p50 {summary['p50_ms']:7.2f} ms"
+                              f"  p95 {summary['p95_ms']:7.2f} ms  p99 {summary['p99_ms']:7.2f} ms  errors {summary['errors']}")
+                finally:
+                    if server is not None:
+                        server.__exit__(None, None, None)
+        finally:
+            os.chdir(previous_dir)
+
+    report = {
+        "meta": {
+            "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "git_revision": git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "trades": args.trades,
+            "types": args.types,
+            "concurrency": args.concurrency,
+            "duration_seconds": args.duration,
+            "seed_seconds": round(seed_seconds, 3),
+        },
+        "results": results,
+    }
+    with open(output_path, "w", encoding="utf-8") as file:
+        json.dump(report, file, indent=2, ensure_ascii=False)
+    print(f"Saved results to {output_path}")
+
+    if baseline_path:
+        compare(results, baseline_path)
+    return report
+
+if __name__ == "__main__":
+    main()
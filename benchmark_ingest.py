@@ -0,0 +1,332 @@
+#MÄTER INLÄSNINGEN OCH RATIOBERÄKNINGEN UTAN GEMINI
+#
+# Runs the ingest pipeline end to end against a local fake LLM, so it can be
+# timed without network access, an API key or quota:
+#
+#   feeder (rule parser / extraction cache / fake Gemini) -> add_trade_entries
+#   -> calculate_relative_values -> save_relative_values / save_value_matrix
+#
+# Each size runs in a fresh temporary directory. Results are saved as JSON;
+# pass --compare with an earlier result file to see the change per stage.
+#
+#   python benchmark_ingest.py --sizes 1000,100000,1000000 --latency-ms 5 --concurrency 8
+#   python benchmark_ingest.py --llm-share 1.0 --prompt-batch-size 10 --output after.json --compare before.json
+
+import argparse
+import contextlib
+import json
+import os
+import platform
+import random
+import re
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+DEFAULT_SIZES = "1000,100000,1000000"
+DEFAULT_LATENCY_MS = 0.0
+DEFAULT_JITTER_MS = 0.0
+DEFAULT_LLM_SHARE = 0.2 # Share of messages phrased so the rule parser leaves them to the LLM
+DEFAULT_REPEAT_SHARE = 0.05 # Share of messages that repost an earlier text (extraction cache hits)
+
+# Ticket type -> a few spellings seen in the feed, used to phrase the synthetic messages
+SPELLINGS = {
+    "GBG": ["1 maj", "GBG", "första maj"],
+    "MÖ": ["yran", "MÖ"],
+    "NSA": ["NSA", "lunds"],
+    "SSK": ["skvalborg", "SSK", "sydskånska"],
+    "VG/H": ["kvalborg", "VG/H"],
+    "T-Bar": ["tbar", "T-Bar"],
+    "ÖG": ["ÖG", "ögs"],
+    "HK": ["HK", "sunwing"],
+}
+NUMBER_WORDS = {1: "en", 2: "två", 3: "tre", 4: "fyra"}
+
+# Phrasings the rule parser answers locally, and ones it leaves to the LLM ("söker" first flips the direction).
+# {n} makes every text unique; it is spelled in letters and glued to a word, since a
+# stray digit or a free-standing letter code ("hk", "en") would change how the rule parser reads it.
+RULE_TEMPLATES = [
+    "Byter {oq} {ot} mot {rq} {rt} (tråd{n})",
+    "Hej! Byter gärna {oq} {ot} mot {rq} {rt} /anv{n}",
+]
+LLM_TEMPLATES = [
+    "Söker {rq} {rt}, har {oq} {ot} att erbjuda (tråd{n})",
+    "Någon som vill ha {oq} {ot}? Vill helst få {rq} {rt} /anv{n}",
+]
+
+# JSON objects matching tradereader's response schema, one per trade (batch answers are a JSON array of them)
+ANSWER_TEMPLATE = ('{{"offered_quantity": {offered_quantity}, "offered_ticket_type": "{offered_ticket_type}", '
+                   '"requested_quantity": {requested_quantity}, "requested_ticket_type": "{requested_ticket_type}"}}')
+BATCH_ANSWER_TEMPLATE = ('{{"item": {number}, "offered_quantity": {offered_quantity}, "offered_ticket_type": "{offered_ticket_type}", '
+                         '"requested_quantity": {requested_quantity}, "requested_ticket_type": "{requested_ticket_type}"}}')
+
+SINGLE_TEXT_PATTERN = re.compile(r'exchange tickets:\s*\n\s*"(.*)"\s*\n')
+BATCH_TEXT_PATTERN = re.compile(r'^\s*Item (\d+): "(.*)"$', re.MULTILINE)
+
+
+class _FakeResponse:
+    def __init__(self, text):
+        self.text = text
+
+
+class _FakeModels:
+    def __init__(self, backend):
+        self.backend = backend
+
+    def generate_content(self, model, contents, config=None):
+        return self.backend.generate(model, contents)
+
+
+class FakeGeminiClient:
+    """
+    Stand-in for genai.Client with configurable latency and answer templates.
+
+    It knows the true trade behind every synthetic message (`answers`, text ->
+    trade tuple) and renders the answers with the templates, the same way
+    Gemini is asked to. Texts it doesn't know, and a `failure_rate` share of
+    calls, get an unparseable answer so the failure paths are exercised too.
+    """
+
+    def __init__(self, answers, latency=0.0, jitter=0.0, failure_rate=0.0,
+                 answer_template=ANSWER_TEMPLATE, batch_answer_template=BATCH_ANSWER_TEMPLATE, seed=0):
+        self.answers = answers
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.answer_template = answer_template
+        self.batch_answer_template = batch_answer_template
+        self.models = _FakeModels(self)
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.calls = 0
+        self.batch_calls = 0
+        self.failures = 0
+
+    def _render(self, template, trade, **extra):
+        offered_quantity, offered_ticket_type, requested_quantity, requested_ticket_type = trade
+        return template.format(offered_quantity=offered_quantity, offered_ticket_type=offered_ticket_type,
+                               requested_quantity=requested_quantity, requested_ticket_type=requested_ticket_type, **extra)
+
+    def generate(self, model, contents):
+        prompt = "\n".join(contents)
+        with self.lock:
+            self.calls += 1
+            delay = max(0.0, self.latency + self.rng.uniform(-self.jitter, self.jitter))
+            fail = self.rng.random() < self.failure_rate
+            if fail:
+                self.failures += 1
+        if delay:
+            time.sleep(delay)
+        if fail:
+            return _FakeResponse("I'm not sure what this message means.")
+
+        items = BATCH_TEXT_PATTERN.findall(prompt)
+        if items:
+            with self.lock:
+                self.batch_calls += 1
+            blocks = [self._render(self.batch_answer_template, self.answers[text], number=number)
+                      for number, text in items if text in self.answers]
+            return _FakeResponse("[" + ", ".join(blocks) + "]")
+
+        match = SINGLE_TEXT_PATTERN.search(prompt)
+        if match and match.group(1) in self.answers:
+            return _FakeResponse(self._render(self.answer_template, self.answers[match.group(1)]))
+        return _FakeResponse("I'm not sure what this message means.")
+
+    def stats(self):
+        with self.lock:
+            return {"calls": self.calls, "batch_calls": self.batch_calls, "failures": self.failures}
+
+
+def _letter_code(n):
+    """Spells a counter in letters, 0 -> "a", 25 -> "z", 26 -> "ba"."""
+    code = ""
+    while True:
+        n, digit = divmod(n, 26)
+        code = chr(ord("a") + digit) + code
+        if not n:
+            return code
+
+def synthetic_messages(count, llm_share=DEFAULT_LLM_SHARE, repeat_share=DEFAULT_REPEAT_SHARE, seed=0):
+    """
+    Returns (messages, answers): `count` trade messages, and the true trade
+    behind every distinct text for the fake client.
+    """
+    rng = random.Random(seed)
+    types = list(SPELLINGS)
+    messages = []
+    answers = {}
+    for n in range(count):
+        if messages and rng.random() < repeat_share:
+            messages.append(rng.choice(messages))
+            continue
+        offered, requested = rng.sample(types, 2)
+        offered_quantity, requested_quantity = rng.randint(1, 4), rng.randint(1, 4)
+        template = rng.choice(LLM_TEMPLATES if rng.random() < llm_share else RULE_TEMPLATES)
+        text = template.format(
+            oq=NUMBER_WORDS[offered_quantity], ot=rng.choice(SPELLINGS[offered]),
+            rq=NUMBER_WORDS[requested_quantity], rt=rng.choice(SPELLINGS[requested]), n=_letter_code(n),
+        )
+        messages.append(text)
+        answers[text] = (offered_quantity, offered, requested_quantity, requested)
+    return messages, answers
+
+
+def _timed(function, *args, **kwargs):
+    started = time.perf_counter()
+    result = function(*args, **kwargs)
+    return result, time.perf_counter() - started
+
+def run_size(size, args):
+    """Runs the whole pipeline for `size` messages in a fresh directory and returns its timings."""
+    messages, answers = synthetic_messages(size, args.llm_share, args.repeat_share)
+    fake = FakeGeminiClient(answers, latency=args.latency_ms / 1000, jitter=args.jitter_ms / 1000,
+                            failure_rate=args.failure_rate)
+
+    previous_dir = os.getcwd()
+    with tempfile.TemporaryDirectory(prefix="benchmark_ingest_") as data_dir:
+        os.chdir(data_dir)
+        # Database files are opened relative to the working directory on first use
+        import database
+        import ratelimiter
+        import ratiocalc
+        import tradereader
+        import tradestorer
+
+        # Database names are relative to the working directory, so drop this thread's
+        # pooled connections and create the tables afresh in the new directory
+        database.close_connections()
+        try:
+            tradestorer.create_trades_table()
+            ratiocalc.create_relative_values_table()
+            tradereader.set_extraction_cache(None) # Reopened in this directory on first use
+            tradereader.set_client(fake)
+            tradereader.reset_rule_parser_stats()
+            # The fake has no quota; keep the limiter in the path but never let it wait
+            tradereader.rate_limiter = ratelimiter.RateLimiter(max_calls=10**9, time_window=1)
+            if args.no_rule_parser:
+                tradereader.RULE_CONFIDENCE_THRESHOLD = 2.0
+
+            output = open(os.devnull, "w") if not args.verbose else sys.stdout
+            with contextlib.redirect_stdout(output):
+                stored, ingest_seconds = _timed(tradereader.feeder, iter(messages), concurrency=args.concurrency,
+                                                insert_batch_size=args.insert_batch_size,
+                                                prompt_batch_size=args.prompt_batch_size)
+                relative_values, aggregate_seconds = _timed(ratiocalc.calculate_relative_values, engine=args.engine)
+                _, save_seconds = _timed(ratiocalc.save_relative_values, relative_values)
+                matrix, matrix_seconds = _timed(ratiocalc.calculate_value_matrix, relative_values)
+                _, save_matrix_seconds = _timed(ratiocalc.save_value_matrix, matrix)
+            if output is not sys.stdout:
+                output.close()
+        finally:
+            database.close_connections()
+            os.chdir(previous_dir)
+
+    total_seconds = ingest_seconds + aggregate_seconds + save_seconds + matrix_seconds + save_matrix_seconds
+    return {
+        "size": size,
+        "stored_trades": stored,
+        "messages_per_second": round(size / ingest_seconds, 1) if ingest_seconds else None,
+        "end_to_end_messages_per_second": round(size / total_seconds, 1) if total_seconds else None,
+        "seconds": {
+            "ingest": round(ingest_seconds, 4),
+            "calculate_relative_values": round(aggregate_seconds, 4),
+            "save_relative_values": round(save_seconds, 4),
+            "calculate_value_matrix": round(matrix_seconds, 4),
+            "save_value_matrix": round(save_matrix_seconds, 4),
+            "total": round(total_seconds, 4),
+        },
+        "llm": fake.stats(),
+        "rule_parser": tradereader.rule_parser_stats(),
+        "extraction_cache": tradereader.get_extraction_cache().stats(),
+        "pairs": len(relative_values or {}),
+    }
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare(results, baseline_path):
+    """Prints the per-stage time change against an earlier result file."""
+    with open(baseline_path, encoding="utf-8") as file:
+        baseline = json.load(file)
+    previous = {row["size"]: row for row in baseline["results"]}
+    print(f"\nCompared with {baseline_path} ({baseline['meta'].get('git_revision')}):")
+    for row in results:
+        old = previous.get(row["size"])
+        if old is None:
+            continue
+        changes = []
+        for stage, seconds in row["seconds"].items():
+            old_seconds = old["seconds"].get(stage)
+            if old_seconds:
+                changes.append(f"{stage} {(seconds / old_seconds - 1) * 100:+.1f}%")
+        print(f"  {row['size']:>9,} messages: " + ", ".join(changes))
+
+def _parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark trade ingest and ratio computation offline with a fake LLM.")
+    parser.add_argument("--sizes", default=DEFAULT_SIZES, help="Comma separated message counts")
+    parser.add_argument("--latency-ms", type=float, default=DEFAULT_LATENCY_MS, help="Fake LLM latency per call")
+    parser.add_argument("--jitter-ms", type=float, default=DEFAULT_JITTER_MS, help="Uniform +- jitter on the latency")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="Share of fake LLM calls that answer garbage")
+    parser.add_argument("--llm-share", type=float, default=DEFAULT_LLM_SHARE, help="Share of messages the rule parser can't handle")
+    parser.add_argument("--repeat-share", type=float, default=DEFAULT_REPEAT_SHARE, help="Share of reposted messages")
+    parser.add_argument("--no-rule-parser", action="store_true", help="Send every message to the (fake) LLM")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--prompt-batch-size", type=int, default=1)
+    parser.add_argument("--insert-batch-size", type=int, default=50)
+    parser.add_argument("--engine", default="python", help="ratiocalc aggregation engine")
+    parser.add_argument("--verbose", action="store_true", help="Keep the pipeline's own per-message output")
+    parser.add_argument("--output", default="benchmark_ingest_results.json", help="Where to save the JSON results")
+    parser.add_argument("--compare", metavar="FILE", help="Earlier results to compare against")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = _parse_args(argv)
+    sizes = [int(size) for size in args.sizes.split(",") if size.strip()]
+    output_path = os.path.abspath(args.output)
+    baseline_path = os.path.abspath(args.compare) if args.compare else None
+    sys.path.insert(0, REPO_DIR)
+
+    results = []
+    for size in sizes:
+        print(f"Running {size:,} messages ...")
+        row = run_size(size, args)
+        results.append(row)
+        seconds = row["seconds"]
+        print(f"  ingest {row['messages_per_second']:,.0f} msg/s ({seconds['ingest']:.2f}s), "
+              f"aggregate {seconds['calculate_relative_values']:.2f}s, save {seconds['save_relative_values']:.2f}s, "
+              f"matrix {seconds['calculate_value_matrix'] + seconds['save_value_matrix']:.2f}s, "
+              f"end to end {row['end_to_end_messages_per_second']:,.0f} msg/s, "
+              f"{row['stored_trades']:,} trades stored, {row['rule_parser']['hits']:,} rule parser hits, "
+              f"{row['llm']['calls']:,} LLM calls")
+
+    report = {
+        "meta": {
+            "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "git_revision": git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "options": {key: value for key, value in vars(args).items() if key not in ("output", "compare")},
+        },
+        "results": results,
+    }
+    with open(output_path, "w", encoding="utf-8") as file:
+        json.dump(report, file, indent=2, ensure_ascii=False)
+    print(f"Saved results to {output_path}")
+
+    if baseline_path:
+        compare(results, baseline_path)
+    return report
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,189 @@
+#MÄTER HUR SNABBT MODULERNA OCH SKRIPTEN STARTAR
+#
+# Imports each module in a fresh interpreter and times it, then runs a few
+# short CLI invocations end to end. Importing must stay free of side effects
+# (no database files are created) and must not load the heavy optional
+# dependencies, which are only needed once they are used:
+#
+#   pydantic / google.genai   tradereader, on the first Gemini call
+#   numpy                     ratiocalc, with engine="numpy"
+#   http.server, asyncio      metrics.start_http_server, RateLimiter.acheck
+#
+# Each import has a budget in milliseconds; the exit status is 1 when one is
+# exceeded, a heavy module is loaded or an import creates a file.
+#
+#   python benchmark_startup.py
+#   python benchmark_startup.py --repeat 20 --output after.json --compare before.json
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+DEFAULT_REPEAT = 10
+
+# Module -> import time budget in ms. flask_port is bound by Flask itself (~150 ms).
+IMPORT_BUDGETS_MS = {
+    "tickettypes": 10,
+    "database": 15,
+    "ratiosnapshot": 15,
+    "tradestorer": 25,
+    "interact": 25,
+    "ratiocalc": 25,
+    "tradereader": 60,
+    "flask_port": 300,
+}
+HEAVY_MODULES = ("pydantic", "google.genai", "numpy", "http.server", "asyncio")
+ALLOWED_HEAVY = {"flask_port": ("http.server",)} # Loaded by Flask's own werkzeug.serving
+
+# Short command line uses, timed as whole processes (interpreter startup included)
+CLI_SNIPPETS = {
+    "python": "pass",
+    "interact.display_relationships": "import interact; interact.display_relationships()",
+    "interact.hypotrade": "import interact; interact.hypotrade('NSA', 3, 'ÖG', 4)",
+}
+DATABASE_FILES = ("ticket_trades.db", "ticket_trades_ratios.db")
+
+IMPORT_SNIPPET = """
+import sys, time
+started = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - started
+import json
+print(json.dumps({{"seconds": elapsed, "heavy": [name for name in {heavy!r} if name in sys.modules]}}))
+"""
+
+def _run(code, cwd):
+    env = dict(os.environ, PYTHONPATH=REPO_DIR)
+    env.pop("PYTHONDONTWRITEBYTECODE", None) # Time imports with bytecode caches, as a deployed app has them
+    return subprocess.run([sys.executable, "-c", code], cwd=cwd, env=env,
+                          capture_output=True, text=True, check=True)
+
+def time_import(module, repeat):
+    """Imports module in `repeat` fresh interpreters inside an empty directory."""
+    timings = []
+    heavy = set()
+    created = set()
+    with tempfile.TemporaryDirectory(prefix="benchmark_startup_") as work_dir:
+        _run(f"import {module}", work_dir) # Unmeasured, writes any missing bytecode caches
+    for _ in range(repeat):
+        with tempfile.TemporaryDirectory(prefix="benchmark_startup_") as work_dir:
+            output = _run(IMPORT_SNIPPET.format(module=module, heavy=HEAVY_MODULES), work_dir).stdout
+            result = json.loads(output.strip().splitlines()[-1]) # Older trees print while importing
+            timings.append(result["seconds"])
+            heavy.update(name for name in result["heavy"] if name not in ALLOWED_HEAVY.get(module, ()))
+            created.update(os.listdir(work_dir))
+    return {
+        "median_ms": round(statistics.median(timings) * 1000, 2),
+        "min_ms": round(min(timings) * 1000, 2),
+        "heavy_modules": sorted(heavy),
+        "created_files": sorted(created),
+    }
+
+def time_cli(code, repeat):
+    """Runs code as a whole process `repeat` times next to copies of the bundled databases."""
+    timings = []
+    with tempfile.TemporaryDirectory(prefix="benchmark_startup_") as work_dir:
+        for name in DATABASE_FILES:
+            if os.path.exists(os.path.join(REPO_DIR, name)):
+                shutil.copy(os.path.join(REPO_DIR, name), work_dir)
+        _run(code, work_dir) # Unmeasured first run, which may migrate the copied databases
+        for _ in range(repeat):
+            started = time.perf_counter()
+            _run(code, work_dir)
+            timings.append(time.perf_counter() - started)
+    return {
+        "median_ms": round(statistics.median(timings) * 1000, 2),
+        "min_ms": round(min(timings) * 1000, 2),
+    }
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare(report, baseline_path):
+    """Prints the change in median time per target against an earlier result file."""
+    with open(baseline_path, encoding="utf-8") as file:
+        baseline = json.load(file)
+    print(f"\nCompared with {baseline_path} ({baseline['meta'].get('git_revision')}):")
+    for section in ("imports", "cli"):
+        for name, row in report[section].items():
+            old = baseline.get(section, {}).get(name)
+            if old and old["median_ms"]:
+                change = (row["median_ms"] / old["median_ms"] - 1) * 100
+                print(f"  {name:<32} {old['median_ms']:>8.1f} ms -> {row['median_ms']:>8.1f} ms ({change:+.1f}%)")
+
+def _parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark module import times and short CLI startup.")
+    parser.add_argument("--repeat", type=int, default=DEFAULT_REPEAT, help="Fresh interpreters per target")
+    parser.add_argument("--modules", default=",".join(IMPORT_BUDGETS_MS), help="Comma separated modules to import")
+    parser.add_argument("--no-cli", action="store_true", help="Only time the imports")
+    parser.add_argument("--output", default="benchmark_startup_results.json", help="Where to save the JSON results")
+    parser.add_argument("--compare", metavar="FILE", help="Earlier results to compare against")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = _parse_args(argv)
+    modules = [module.strip() for module in args.modules.split(",") if module.strip()]
+    failures = []
+
+    imports = {}
+    for module in modules:
+        row = imports[module] = time_import(module, args.repeat)
+        budget = IMPORT_BUDGETS_MS.get(module)
+        row["budget_ms"] = budget
+        problems = []
+        if budget is not None and row["median_ms"] > budget:
+            problems.append(f"over the {budget} ms budget")
+        if row["heavy_modules"]:
+            problems.append(f"loads {', '.join(row['heavy_modules'])}")
+        if row["created_files"]:
+            problems.append(f"creates {', '.join(row['created_files'])}")
+        failures.extend(f"{module}: {problem}" for problem in problems)
+        print(f"  import {module:<32} {row['median_ms']:>8.1f} ms (min {row['min_ms']:.1f}, budget {budget} ms)"
+              + (f"  FAIL: {'; '.join(problems)}" if problems else ""))
+
+    cli = {}
+    if not args.no_cli:
+        for name, code in CLI_SNIPPETS.items():
+            row = cli[name] = time_cli(code, args.repeat)
+            print(f"  run    {name:<32} {row['median_ms']:>8.1f} ms (min {row['min_ms']:.1f})")
+
+    report = {
+        "meta": {
+            "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "git_revision": git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "repeat": args.repeat,
+        },
+        "imports": imports,
+        "cli": cli,
+        "failures": failures,
+    }
+    output_path = os.path.abspath(args.output)
+    with open(output_path, "w", encoding="utf-8") as file:
+        json.dump(report, file, indent=2, ensure_ascii=False)
+    print(f"Saved results to {output_path}")
+
+    if args.compare:
+        compare(report, os.path.abspath(args.compare))
+    for failure in failures:
+        print(f"FAIL {failure}")
+    return report
+
+if __name__ == "__main__":
+    sys.exit(1 if main()["failures"] else 0)
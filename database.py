@@ -0,0 +1,65 @@
+#DELAD DATABASÅTKOMST FÖR ALLA MODULER
+
+import os
+import sqlite3
+import threading
+import metrics
+
+# Applied to every connection opened through get_connection().
+# WAL lets the API readers and the ingest writer work at the same time,
+# synchronous=NORMAL is durable enough in WAL mode and skips an fsync per commit.
+CONNECTION_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA cache_size=-16000",  # Negative means KiB, ~16 MB page cache per connection
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA busy_timeout=30000",
+)
+
+STATEMENT_CACHE_SIZE = 256 # Prepared statements kept per connection by the sqlite3 module
+
+_local = threading.local()
+
+# Connections a forked child inherited from its parent. They are never used or
+# closed in the child: closing one (which garbage collection would do once it
+# is unreferenced) releases locks the parent still holds on the database file.
+_inherited_connections = []
+
+def keep_inherited(connections):
+    """Keeps connections opened before a fork referenced for the life of the process, unused."""
+    _inherited_connections.extend(connections)
+
+def _open_connection(db_name):
+    with metrics.timer("db_connect_seconds", db=db_name):
+        conn = sqlite3.connect(db_name, timeout=30, cached_statements=STATEMENT_CACHE_SIZE)
+        for pragma in CONNECTION_PRAGMAS:
+            conn.execute(pragma)
+    return conn
+
+def get_connection(db_name):
+    """
+    Returns this thread's long-lived connection to db_name, opening it on first use.
+
+    Connections are never closed by callers; statements executed repeatedly on
+    the same connection reuse their prepared form from the statement cache.
+    Callers still commit/rollback their own transactions.
+    """
+    connections = getattr(_local, "connections", None)
+    if connections is None or _local.pid != os.getpid():
+        # First use in this thread, or we are in a forked child that must not reuse the parent's handles
+        if connections is not None:
+            keep_inherited(connections.values())
+        connections = _local.connections = {}
+        _local.pid = os.getpid()
+
+    conn = connections.get(db_name)
+    if conn is None:
+        conn = connections[db_name] = _open_connection(db_name)
+    return conn
+
+def close_connections():
+    """Closes every connection held by the calling thread."""
+    connections = getattr(_local, "connections", None) or {}
+    for conn in connections.values():
+        conn.close()
+    connections.clear()
@@ -0,0 +1,124 @@
+#SPARAR GEMINIS TOLKNINGAR SÅ SAMMA TEXT INTE SKICKAS IGEN
+
+import hashlib
+import re
+import threading
+import time
+from database import get_connection
+
+EXTRACTION_CACHE_NAME = "extraction_cache.db"
+
+class ExtractionCache:
+    """
+    On-disk cache of parsed trades, keyed by a hash of the normalized message
+    text and a namespace (model + prompt version). Reposted messages and
+    reprocessed files are answered from here instead of Gemini.
+
+    Every EVICT_EVERY puts, entries beyond max_entries are evicted in least
+    recently used order.
+    """
+
+    EVICT_EVERY = 100 # Puts between eviction checks, keeps COUNT(*) off the hot path
+
+    def __init__(self, path=EXTRACTION_CACHE_NAME, max_entries=50000, namespace=""):
+        self.path = path
+        self.max_entries = max_entries
+        self.namespace = namespace
+        self.hits = 0
+        self.misses = 0
+        self.puts_since_evict = 0
+        self.lock = threading.Lock()  # Guards the counters, SQLite handles its own locking
+        self.create_table()
+
+    def create_table(self):
+        conn = get_connection(self.path)
+        cursor = conn.cursor()
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS extraction_cache (
+                key TEXT PRIMARY KEY,
+                offered_quantity INTEGER,
+                offered_ticket_type TEXT,
+                requested_quantity INTEGER,
+                requested_ticket_type TEXT,
+                last_used REAL
+            )
+        """)
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_extraction_cache_last_used ON extraction_cache (last_used)")
+        conn.commit()
+
+    @staticmethod
+    def normalize(text):
+        """Lowercases and collapses whitespace so trivially different reposts share a key."""
+        return re.sub(r"\s+", " ", text).strip().lower()
+
+    def key(self, text):
+        content = f"{self.namespace}\0{self.normalize(text)}"
+        return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+    def get(self, text):
+        """
+        Returns the cached (offered_quantity, offered_ticket_type,
+        requested_quantity, requested_ticket_type) tuple, or None on a miss.
+        """
+        key = self.key(text)
+        conn = get_connection(self.path)
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT offered_quantity, offered_ticket_type, requested_quantity, requested_ticket_type
+            FROM extraction_cache WHERE key = ?
+        """, (key,))
+        row = cursor.fetchone()
+        if row is not None:
+            cursor.execute("UPDATE extraction_cache SET last_used = ? WHERE key = ?", (time.time(), key))
+            conn.commit()
+
+        with self.lock:
+            if row is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return row
+
+    def put(self, text, result):
+        """Stores a parsed trade tuple for text."""
+        conn = get_connection(self.path)
+        cursor = conn.cursor()
+        cursor.execute("""
+            INSERT OR REPLACE INTO extraction_cache
+                (key, offered_quantity, offered_ticket_type, requested_quantity, requested_ticket_type, last_used)
+            VALUES (?, ?, ?, ?, ?, ?)
+        """, (self.key(text), *result, time.time()))
+        conn.commit()
+
+        with self.lock:
+            self.puts_since_evict += 1
+            evict = self.puts_since_evict >= self.EVICT_EVERY
+            if evict:
+                self.puts_since_evict = 0
+        if evict:
+            self.evict()
+
+    def evict(self):
+        """Deletes the least recently used entries beyond max_entries."""
+        conn = get_connection(self.path)
+        cursor = conn.cursor()
+        cursor.execute("SELECT COUNT(*) FROM extraction_cache")
+        excess = cursor.fetchone()[0] - self.max_entries
+        if excess > 0:
+            cursor.execute("""
+                DELETE FROM extraction_cache WHERE key IN (
+                    SELECT key FROM extraction_cache ORDER BY last_used LIMIT ?
+                )
+            """, (excess,))
+            conn.commit()
+        return max(excess, 0)
+
+    def stats(self):
+        with self.lock:
+            hits, misses = self.hits, self.misses
+        total = hits + misses
+        return {
+            "hits": hits,
+            "misses": misses,
+            "hit_ratio": round(hits / total, 3) if total else None,
+        }
@@ -1,7 +1,22 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response
 from flask_cors import CORS
+import gzip
+from collections.abc import Mapping
+import hashlib
+import os
 import sqlite3 # Keep for catching potential DB errors at API layer if needed
-from interact import *
+import time
+from flask import g
+from interact import (MAX_BATCH_SIZE, RATIO_DATABASE_NAME, fetch_relative_values, hypotrade,
+                      hypotrade_batch, is_valid_window, oneofthisequals, ratio_cache_stats)
+import metrics
+
+try:
+    import brotli # Optional, only used to pre-compress cached bodies
+except ImportError:
+    brotli = None
+
+MIN_COMPRESS_BYTES = 512 # Bodies smaller than this are served uncompressed
 
 
 # --- Flask App Setup ---
@@ -34,19 +49,110 @@ def handle_logic_error(result):
         # Add more specific mappings if the logic module defines more error types
 
         print(f"API Error Response: status={status_code}, type={error_type}, msg={message}") # Log errors server-side
+        metrics.inc("api_errors_total", error=error_type)
         return jsonify({"error": error_type, "message": message}), status_code
     # No error found in the dictionary
     return None
 
 
+def get_window_param():
+    """Reads the optional ?window= parameter. Returns (window, error_response)."""
+    window = request.args.get('window') or None
+    if not is_valid_window(window):
+        return None, (jsonify({"error": "invalid_parameter", "message": f"Unknown window '{window}'. Use 1h, 24h, 7d or decay."}), 400)
+    return window, None
+
+
+# --- Request Metrics ---
+# Only hooked in when metrics are enabled, so a disabled setup runs no extra code per request
+if metrics.ENABLED:
+    @app.before_request
+    def start_request_timer():
+        g.request_started = time.perf_counter()
+
+    @app.after_request
+    def record_request_metrics(response):
+        started = g.pop('request_started', None)
+        if started is not None:
+            # The route pattern, not the raw path, keeps the label set small
+            endpoint = request.url_rule.rule if request.url_rule is not None else "<unmatched>"
+            metrics.observe("http_request_seconds", time.perf_counter() - started,
+                            endpoint=endpoint, method=request.method, status=response.status_code)
+        return response
+
+
+# --- Pre-serialized Responses ---
+# fetch_relative_values returns the same object until the ratio data changes,
+# so the serialized body is cached per window and rebuilt only when a new
+# result object shows up. window -> entry dict, see _build_cached_body.
+_relationships_bodies = {}
+
+def _build_cached_body(body):
+    """Precomputes the ETag and compressed variants for a serialized body."""
+    entry = {
+        "identity": body,
+        "etag": hashlib.sha256(body).hexdigest(),
+        "last_modified": int(time.time()), # When the data behind this body was (re)loaded
+    }
+    if len(body) >= MIN_COMPRESS_BYTES:
+        entry["gzip"] = gzip.compress(body, compresslevel=9)
+        if brotli is not None:
+            entry["br"] = brotli.compress(body)
+    return entry
+
+def _relationships_entry(window, result):
+    cached = _relationships_bodies.get(window)
+    if cached is not None and cached["result"] is result:
+        return cached
+
+    relationships_list = []
+    for (type_a, type_b), stats in result.items():
+        relationships_list.append({
+            "type_a": type_a,
+            "type_b": type_b,
+            # Use .get with default for robustness against missing keys in stats
+            "average_ratio": round(stats.get('average_ratio', 0), 3),
+            "trade_count": stats.get('trade_count', 0)
+        })
+    entry = _build_cached_body(jsonify(relationships_list).get_data())
+    entry["result"] = result # Held (not just its id) so the identity check can't match a recycled object
+    _relationships_bodies[window] = entry
+    return entry
+
+def cached_body_response(entry):
+    """
+    Serves a pre-serialized entry: picks the best pre-compressed variant the
+    client accepts, sets a strong ETag and Last-Modified, and answers
+    If-None-Match / If-Modified-Since with 304.
+    """
+    encoding = "identity"
+    for candidate in ("br", "gzip"):
+        if candidate in entry and request.accept_encodings.quality(candidate) > 0:
+            encoding = candidate
+            break
+
+    response = Response(entry[encoding], mimetype="application/json")
+    # Each encoding is a different byte sequence, so it gets its own strong validator
+    etag = entry["etag"] if encoding == "identity" else f'{entry["etag"]}-{encoding}'
+    response.set_etag(etag)
+    response.last_modified = entry["last_modified"]
+    response.vary.add("Accept-Encoding")
+    if encoding != "identity":
+        response.content_encoding = encoding
+    return response.make_conditional(request)
+
+
 # --- API Endpoints ---
 
 @app.route('/relationships', methods=['GET'])
 def get_relationships():
     """API endpoint calling fetch_relative_values."""
+    window, window_error = get_window_param()
+    if window_error:
+        return window_error
     try:
         # Call the imported function directly
-        result = fetch_relative_values()
+        result = fetch_relative_values(window)
     except sqlite3.Error as e:
          # Catch DB errors that might occur outside the logic function's own try-except
          # (e.g., potentially during initial connection if not caught inside)
@@ -62,23 +168,11 @@ def get_relationships():
     if error_response:
         return error_response
 
-    # Handle case where DB exists but table is empty (returns empty dict)
-    if isinstance(result, dict) and not result:
-        return jsonify([]) # Return empty list as per previous design
-
-    # Format the result dictionary {(type_a, type_b): stats} into a JSON list
+    # Format the result dictionary {(type_a, type_b): stats} into a JSON list,
+    # serialized once per data version (an empty table gives an empty list)
     # Check if it's the expected dictionary format before processing
-    if isinstance(result, dict):
-        relationships_list = []
-        for (type_a, type_b), stats in result.items():
-            relationships_list.append({
-                "type_a": type_a,
-                "type_b": type_b,
-                # Use .get with default for robustness against missing keys in stats
-                "average_ratio": round(stats.get('average_ratio', 0), 3),
-                "trade_count": stats.get('trade_count', 0)
-            })
-        return jsonify(relationships_list)
+    if isinstance(result, Mapping): # A dict, or the ratiosnapshot view of the all-time table
+        return cached_body_response(_relationships_entry(window, result))
     else:
         # Should not happen if logic function works as documented, but handle defensively
         print(f"Unexpected result type from fetch_relative_values: {type(result)}")
@@ -103,6 +197,10 @@ def api_hypotrade():
     if missing_params:
         return jsonify({"error": "missing_parameters", "message": f"Missing required query parameters: {', '.join(missing_params)}"}), 400
 
+    window, window_error = get_window_param()
+    if window_error:
+        return window_error
+
     try:
         # Convert amounts to integers for the logic function
         off_a = int(off_a_str)
@@ -115,7 +213,7 @@ def api_hypotrade():
 
     # --- Call Logic Function ---
     # No try-except needed here as the provided logic function handles internal errors
-    result = hypotrade(off_t, off_a, req_t, req_a)
+    result = hypotrade(off_t, off_a, req_t, req_a, window)
 
     # --- Handle Potential Errors Returned by Logic ---
     error_response = handle_logic_error(result)
@@ -127,6 +225,28 @@ def api_hypotrade():
     return jsonify(result)
 
 
+@app.route('/hypotrade/batch', methods=['POST'])
+def api_hypotrade_batch():
+    """API endpoint calling hypotrade_batch for a JSON array of trades."""
+    # --- Get and Validate the Body ---
+    payload = request.get_json(silent=True)
+    # Accept a bare array or {"trades": [...]}
+    trades = payload.get('trades') if isinstance(payload, dict) else payload
+    if not isinstance(trades, list):
+        return jsonify({"error": "invalid_body", "message": "Expected a JSON array of trades (or an object with a 'trades' array)."}), 400
+    if len(trades) > MAX_BATCH_SIZE:
+        return jsonify({"error": "batch_too_large", "message": f"At most {MAX_BATCH_SIZE} trades per request, got {len(trades)}."}), 400
+
+    window, window_error = get_window_param()
+    if window_error:
+        return window_error
+
+    # --- Call Logic Function ---
+    # Per-trade problems come back as error entries inside the results, not as a failed request
+    results = hypotrade_batch(trades, window)
+    return jsonify({"count": len(results), "results": results})
+
+
 @app.route('/equivalents', methods=['GET'])
 def api_oneofthisequals():
     """API endpoint calling calculate_equivalents."""
@@ -141,6 +261,10 @@ def api_oneofthisequals():
     if missing_params:
          return jsonify({"error": "missing_parameters", "message": f"Missing required query parameters: {', '.join(missing_params)}"}), 400
 
+    window, window_error = get_window_param()
+    if window_error:
+        return window_error
+
     try:
         # Convert quantity to float for the logic function
         base_quantity = float(base_quantity_str)
@@ -152,7 +276,7 @@ def api_oneofthisequals():
 
     # --- Call Logic Function ---
     # No try-except needed here as the provided logic function handles internal errors
-    result = oneofthisequals(base_type, base_quantity)
+    result = oneofthisequals(base_type, base_quantity, window)
 
     # --- Handle Potential Errors Returned by Logic ---
     error_response = handle_logic_error(result)
@@ -164,6 +288,18 @@ def api_oneofthisequals():
     return jsonify(result)
 
 
+@app.route('/cache_stats', methods=['GET'])
+def api_cache_stats():
+    """API endpoint reporting hit/miss counts of the in-memory ratio cache."""
+    return jsonify(ratio_cache_stats())
+
+
+@app.route('/metrics', methods=['GET'])
+def api_metrics():
+    """Prometheus scrape endpoint: latency histograms, counters and cache statistics."""
+    return Response(metrics.render(), mimetype=metrics.CONTENT_TYPE)
+
+
 # --- Run the App ---
 if __name__ == "__main__":
     # Use the imported constant to show the DB path being used by the logic module
@@ -172,6 +308,6 @@ if __name__ == "__main__":
     print(f"Starting Flask server...")
     # Runs the Flask development server
     # host='0.0.0.0' makes it accessible from other devices on the network
-    # debug=True enables auto-reloading on code changes and detailed error pages
-    # Important: Set debug=False in a production environment!
-    app.run(host='0.0.0.0', port=5001, debug=True)
\ No newline at end of file
+    # FLASK_DEBUG=1 enables auto-reloading on code changes and detailed error pages
+    # For production, serve with gunicorn instead: gunicorn -c gunicorn.conf.py flask_port:app
+    app.run(host='0.0.0.0', port=5001, debug=os.environ.get("FLASK_DEBUG") == "1")
\ No newline at end of file
@@ -1,18 +1,82 @@
 #INTERAGERA MED RATIOSARNA 
 
+import os
 import sqlite3
+import threading
+import time
+from database import get_connection, keep_inherited
+import tickettypes
+import ratiosnapshot
+import metrics
 
 RATIO_DATABASE_NAME = "ticket_trades_ratios.db"
+TRADE_DATABASE_NAME = 'ticket_trades.db' # Holds the time buckets behind windowed ratios
 
-def fetch_relative_values():
-    conn = sqlite3.connect(RATIO_DATABASE_NAME)
+# --- Process-level ratio cache ---
+# The ratio tables only change when ratiocalc saves new values, so the parsed
+# dicts are kept in memory and reloaded only when SQLite reports a change.
+# PRAGMA data_version changes whenever another connection commits to the
+# database file, which covers ratiocalc running in this or another process.
+_ratio_cache = {} # name -> (version, value)
+_ratio_cache_stats = {'hits': 0, 'misses': 0}
+_ratio_cache_lock = threading.RLock() # Re-entrant: the matrix loader may fetch the ratio table
+_version_conns = {}
+
+def _data_version(db_name):
+    """Returns the current data_version of db_name (cheap, no table read)."""
+    conn = _version_conns.get(db_name)
+    if conn is None:
+        # Dedicated connection outside the database.py pool that never writes, so every
+        # commit (even from this process' pooled connections) counts as "another connection"
+        conn = _version_conns[db_name] = sqlite3.connect(db_name, check_same_thread=False)
+    return conn.execute("PRAGMA data_version").fetchone()[0]
+
+def _ratio_table_version():
+    return _data_version(RATIO_DATABASE_NAME)
+
+def _window_version():
+    """Windowed ratios change when new trades are aggregated and when the clock enters a new bucket."""
+    from ratiocalc import BUCKET_SECONDS
+    return _data_version(TRADE_DATABASE_NAME), int(time.time() // BUCKET_SECONDS)
+
+def _cached(name, loader, version_function=_ratio_table_version):
+    """Returns loader()'s result, cached until version_function() reports a change."""
+    with _ratio_cache_lock:
+        version = version_function()
+        cached = _ratio_cache.get(name)
+        if cached is not None and cached[0] == version:
+            _ratio_cache_stats['hits'] += 1
+            return cached[1]
+
+        _ratio_cache_stats['misses'] += 1
+        with metrics.timer("ratio_cache_load_seconds", table=name):
+            value = loader()
+        _ratio_cache[name] = (version, value)
+        return value
+
+_ratio_schema_ready = set() # Absolute paths of ratio databases this process has checked or upgraded
+
+def _ratio_connection():
+    """
+    Returns this thread's connection to the ratio database, letting ratiocalc
+    upgrade its tables (canonical ticket type names) the first time this
+    process reads that database file.
+    """
+    path = os.path.abspath(RATIO_DATABASE_NAME)
+    if path not in _ratio_schema_ready:
+        from ratiocalc import create_relative_values_table
+        create_relative_values_table()
+        _ratio_schema_ready.add(path)
+    return get_connection(RATIO_DATABASE_NAME)
+
+def _load_relative_values():
+    conn = _ratio_connection()
     cursor = conn.cursor()
     cursor.execute('''
         SELECT type_a, type_b, average_ratio, trade_count
         FROM ticket_trades_ratios
     ''')
     results = cursor.fetchall()
-    conn.close()
 
     # Transform into a similar structure as before for easier use
     relative_values = {}
@@ -23,6 +87,177 @@ def fetch_relative_values():
         }
     return relative_values
 
+def _load_windowed_values(window):
+    from ratiocalc import calculate_windowed_values
+    return calculate_windowed_values(window)
+
+def _load_windowed_matrix(window):
+    from ratiocalc import calculate_value_matrix
+    value_matrix = calculate_value_matrix(fetch_relative_values(window))
+    types = sorted({ticket_type for pair in value_matrix for ticket_type in pair})
+    return {'types': types, 'pairs': value_matrix}
+
+def _load_value_matrix():
+    conn = _ratio_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute('''
+            SELECT type_a, type_b, ratio, trade_count, source
+            FROM ticket_value_matrix
+        ''')
+        results = cursor.fetchall()
+    except sqlite3.OperationalError:
+        results = [] # Table not created yet, ratiocalc hasn't run since the upgrade
+
+    value_matrix = {}
+    for type_a, type_b, ratio, trade_count, source in results:
+        value_matrix[(type_a, type_b)] = {
+            'ratio': ratio,
+            'trade_count': trade_count,
+            'source': source
+        }
+    if not value_matrix:
+        # Fall back to the direct pairs so lookups behave as before the matrix existed
+        for pair, stats in fetch_relative_values().items():
+            if stats['average_ratio'] is not None:
+                value_matrix[pair] = {
+                    'ratio': stats['average_ratio'],
+                    'trade_count': stats['trade_count'],
+                    'source': 'direct'
+                }
+    types = sorted({ticket_type for pair in value_matrix for ticket_type in pair})
+    return {'types': types, 'pairs': value_matrix}
+
+def _load_generation():
+    return ratiosnapshot.read_generation(_ratio_connection())
+
+def _current_snapshot():
+    """
+    Returns ratiocalc's published ratiosnapshot if it was read at the ratio
+    tables' current generation, otherwise None (no snapshot, or the tables
+    were changed without publishing one, restored, or replaced).
+    """
+    snapshot = ratiosnapshot.current()
+    if snapshot is None:
+        return None
+    # Cached until data_version changes, so this is one PRAGMA per call, like the dict cache
+    generation = _cached('generation', _load_generation)
+    if generation is None or snapshot.generation != generation:
+        return None
+    return snapshot
+
+def fetch_relative_values(window=None):
+    """
+    Returns the ratio table as {(type_a, type_b): {'average_ratio', 'trade_count'}}.
+
+    The dict is cached for the whole process and shared between callers, so it
+    must be treated as read-only. It is reloaded from the database only when
+    the ratio table has been changed since the last load.
+
+    The all-time table is served from ratiocalc's published ratiosnapshot when
+    there is one matching the database, which needs no table reads at all.
+
+    Args:
+        window (str): Optional ratiocalc window ('1h', '24h', '7d' or 'decay').
+                      Windowed ratios are computed from ratiocalc's time buckets
+                      and cached until new trades are aggregated or the current
+                      bucket rolls over.
+    """
+    if window is None:
+        snapshot = _current_snapshot()
+        if snapshot is not None:
+            return snapshot.relative_values
+        return _cached('relative_values', _load_relative_values)
+    return _cached(f'relative_values:{window}', lambda: _load_windowed_values(window), _window_version)
+
+def fetch_value_matrix(window=None):
+    """
+    Returns the all-pairs value matrix computed by ratiocalc as
+    {'types': [...], 'pairs': {(type_a, type_b): {'ratio', 'trade_count', 'source'}}},
+    where source is 'direct' for traded pairs and 'derived' for multi-hop ones.
+    Cached and read-only, like fetch_relative_values(), and takes the same window.
+    """
+    if window is None:
+        snapshot = _current_snapshot()
+        if snapshot is not None:
+            return snapshot.value_matrix
+        return _cached('value_matrix', _load_value_matrix)
+    return _cached(f'value_matrix:{window}', lambda: _load_windowed_matrix(window), _window_version)
+
+def is_valid_window(window):
+    """True for None (all-time) and for every window ratiocalc can serve."""
+    from ratiocalc import WINDOWS, DECAY_WINDOW
+    return window is None or window in WINDOWS or window == DECAY_WINDOW
+
+def invalidate_ratio_cache():
+    """Drops the cached ratio tables so the next fetch reloads them from the database."""
+    with _ratio_cache_lock:
+        _ratio_cache.clear()
+
+def warm_ratio_cache(windows=()):
+    """
+    Loads the all-time ratio table and value matrix (and those of any given
+    windows) into the cache. A preloading server calls this in its master
+    process, so forked workers start with the same snapshot in shared
+    copy-on-write memory instead of each loading their own.
+    """
+    for window in (None, *windows):
+        fetch_relative_values(window)
+        fetch_value_matrix(window)
+
+def reset_after_fork():
+    """
+    Call in a freshly forked worker before it serves requests.
+
+    SQLite connections must not be used or closed across fork, so the
+    inherited data_version connections are set aside (kept open, never
+    touched) and new ones are opened. data_version values
+    are only comparable on the same connection, so the inherited cache
+    entries are re-stamped with the new connections' versions instead of
+    being thrown away. A commit landing between the master's last cache check
+    and this call is picked up with the next change; ratiocalc refreshes
+    often enough that this window (milliseconds after a fork) doesn't matter.
+    """
+    with _ratio_cache_lock:
+        keep_inherited(_version_conns.values())
+        _version_conns.clear()
+        for name, (version, value) in list(_ratio_cache.items()):
+            if isinstance(version, tuple):
+                # Windowed entry: keep its bucket so a rolled-over window still reloads
+                version = (_data_version(TRADE_DATABASE_NAME), version[1])
+            else:
+                version = _ratio_table_version()
+            _ratio_cache[name] = (version, value)
+
+def ratio_cache_stats():
+    """Returns hit/miss counters for the ratio cache."""
+    with _ratio_cache_lock:
+        hits = _ratio_cache_stats['hits']
+        misses = _ratio_cache_stats['misses']
+        cached_relative_values = _ratio_cache.get('relative_values', (None, {}))[1]
+        generation = _ratio_cache.get('generation', (None, None))[1]
+    snapshot = ratiosnapshot.current()
+    if snapshot is not None and (generation is None or snapshot.generation != generation):
+        snapshot = None # Last seen as stale by the fetch functions
+    total = hits + misses
+    return {
+        'hits': hits,
+        'misses': misses,
+        'hit_ratio': round(hits / total, 3) if total else None,
+        'cached_pairs': len(cached_relative_values),
+        'snapshot_created': snapshot.created if snapshot is not None else None, # All-time lookups bypass the cache when set
+    }
+
+def _cache_metrics():
+    stats = ratio_cache_stats()
+    return [
+        ("ratio_cache_hits_total", "counter", {}, stats['hits']),
+        ("ratio_cache_misses_total", "counter", {}, stats['misses']),
+        ("ratio_cache_hit_ratio", "gauge", {}, stats['hit_ratio']),
+    ]
+
+metrics.register_collector(_cache_metrics)
+
 def display_relationships():
     relative_values = fetch_relative_values()
     if relative_values is not None:
@@ -39,10 +274,23 @@ def display_relationships():
                 print(f" - 1 {type_a} is worth {ratio} {type_b} (based on {count} trades)")
 
 # Check a hypothetical trade
-def hypotrade(off_t: str, off_a: int, req_t: str, req_a: int):
-    relative_values = fetch_relative_values()
+def hypotrade(off_t: str, off_a: int, req_t: str, req_a: int, window: str = None):
+    return _evaluate_trade(fetch_value_matrix(window), off_t, off_a, req_t, req_a)
+
+def _canonical(ticket_type):
+    # Any registry spelling ("T-bar", "yran") finds the stored type; unknown names are kept for the error message
+    return tickettypes.normalize(ticket_type) or ticket_type
+
+def _evaluate_trade(value_matrix, off_t, off_a, req_t, req_a):
+    off_t = _canonical(off_t)
+    req_t = _canonical(req_t)
+    for ticket_type in (off_t, req_t):
+        if ticket_type not in value_matrix['types']:
+            return {"error": "type_not_found", "message": f"Ticket type '{ticket_type}' not found in any recorded relationships."}
     off_req_key = (off_t, req_t)
-    avg_ratio = relative_values[off_req_key]['average_ratio']
+    if off_req_key not in value_matrix['pairs']:
+        return {"error": "relation_not_found", "message": f"No chain of trades links {off_t} and {req_t}."}
+    avg_ratio = value_matrix['pairs'][off_req_key]['ratio']
     trade_ratio = req_a / off_a # How many requested per offered in this trade
     trade_ratio_rounded = round(trade_ratio, 1)
 
@@ -61,28 +309,80 @@ def hypotrade(off_t: str, off_a: int, req_t: str, req_a: int):
             "your_ratio": round(trade_ratio, 1),
             "average_ratio": round(avg_ratio, 1),
             "ratio_unit": f"{req_t}_per_{off_t}",
+            "ratio_source": value_matrix['pairs'][off_req_key]['source'],
         }
     return info_dict
 
-def oneofthisequals(base_type: str, base_quantity: float):
+MAX_BATCH_SIZE = 500 # Trades accepted by one hypotrade_batch call
+BATCH_TRADE_FIELDS = ("off_t", "off_a", "req_t", "req_a")
+
+def _validate_batch_item(item):
+    """Returns (off_t, off_a, req_t, req_a), or an error dict for a malformed item."""
+    if not isinstance(item, dict):
+        return {"error": "invalid_parameter_type", "message": "Each trade must be an object with off_t, off_a, req_t and req_a."}
+    missing = [field for field in BATCH_TRADE_FIELDS if item.get(field) in (None, "")]
+    if missing:
+        return {"error": "missing_parameters", "message": f"Missing required fields: {', '.join(missing)}"}
+    off_t, req_t = item["off_t"], item["req_t"]
+    if not isinstance(off_t, str) or not isinstance(req_t, str):
+        return {"error": "invalid_parameter_type", "message": "off_t and req_t must be strings."}
+    try:
+        for field in ("off_a", "req_a"):
+            # int() would silently accept true as 1 and truncate 2.7 to 2, which GET /hypotrade rejects
+            value = item[field]
+            if isinstance(value, bool) or (isinstance(value, float) and not value.is_integer()):
+                raise ValueError(f"{value!r} is not an integer")
+        off_a = int(item["off_a"])
+        req_a = int(item["req_a"])
+        if off_a <= 0 or req_a <= 0:
+            raise ValueError(f"{off_a if off_a <= 0 else req_a} is not greater than zero")
+    except (TypeError, ValueError) as e:
+        return {"error": "invalid_parameter_type", "message": f"Invalid amount provided: {e}. Amounts must be positive integers."}
+    return off_t, off_a, req_t, req_a
+
+def hypotrade_batch(trades, window: str = None):
+    """
+    Evaluates many hypothetical trades against one snapshot of the value matrix.
+
+    Args:
+        trades (list): Dicts with off_t, off_a, req_t and req_a, as for hypotrade().
+        window (str): Optional ratiocalc window, shared by every trade.
+
+    Returns:
+        list: One dict per trade, in input order, each with its "index" and
+              either hypotrade()'s result or that trade's "error"/"message".
+              A bad trade never fails the rest of the batch.
+    """
+    value_matrix = fetch_value_matrix(window)
+    results = []
+    for index, item in enumerate(trades):
+        parsed = _validate_batch_item(item)
+        if isinstance(parsed, dict):
+            result = parsed
+        else:
+            result = _evaluate_trade(value_matrix, *parsed)
+        results.append({"index": index, **result})
+    return results
+
+def oneofthisequals(base_type: str, base_quantity: float, window: str = None):
     """
     Calculates the equivalent value of other ticket types based on a given quantity of a base type.
+    Uses the all-pairs value matrix, so types that never traded directly with
+    base_type are still valued through other trades.
 
     Returns:
         dict: A dictionary where keys are other ticket types and values are
               their calculated equivalent quantities. Returns an empty dict if
               no relationships can be found or data is missing.
     """
-    relative_values = fetch_relative_values()
-    if relative_values is None or not relative_values:
+    value_matrix = fetch_value_matrix(window)
+    if not value_matrix['pairs']:
         print("Cannot calculate relative values: No relationship data available.")
         return {}
+    base_type = _canonical(base_type)
 
     equivalents = {}
-    all_types = set()
-    for type_a, type_b in relative_values.keys():
-        all_types.add(type_a)
-        all_types.add(type_b)
+    all_types = value_matrix['types']
 
     if base_type not in all_types:
         print(f"Warning: Base type '{base_type}' not found in any recorded relationships.")
@@ -96,10 +396,10 @@ def oneofthisequals(base_type: str, base_quantity: float):
 
         equivalent_quantity = None
 
-        # Try direct relationship: base_type -> other_type
-        direct_key = (base_type, other_type)
-        if direct_key in relative_values:
-            ratio = relative_values[direct_key]['average_ratio']
+        # Direct or multi-hop relationship: base_type -> other_type
+        matrix_key = (base_type, other_type)
+        if matrix_key in value_matrix['pairs']:
+            ratio = value_matrix['pairs'][matrix_key]['ratio']
             equivalent_quantity = base_quantity * ratio
             #print(f"1 {base_type} = {ratio} {other_type}. ", end="") # Debug / Info line
 
@@ -1,7 +1,28 @@
 #SKAPAR EN LISTA UTAV TRADES
 
+import gzip
+import hashlib
+import json
+import os
+import re
+from collections import deque
+
 trades_file = "/Users/rasmusalpsten/Drive C/Code/Python Projects/Tickettrader"
 
+GZIP_MAGIC = b"\x1f\x8b"
+FINGERPRINT_BYTES = 4096 # Leading bytes hashed to recognise the file a checkpoint belongs to
+
+# Start of a post in typical chat exports, e.g. "[2024-04-12 18:03] Name: ..." or "12/04/2024, 18:03 - Name: ...".
+# Lines not matching it continue the previous post. The match covers the whole
+# date / time / author header, which iter_records drops, so the same text posted
+# by anyone at any time reads (and caches) as the same message.
+CHAT_EXPORT_RECORD_START = re.compile(
+    r"^\[?\d{1,4}[-/.]\d{1,2}[-/.]\d{2,4}"                  # Date
+    r"(?:,?\s*\d{1,2}[:.]\d{2}(?:[:.]\d{2})?(?:\s*[AaPp]\.?[Mm]\.?)?)?" # Optional time
+    r"\]?\s*(?:-\s*)?"
+    r"(?:[^:\[\]]{1,64}?:(?:\s+|$))?"                          # Optional "Name:"
+)
+
 def text_to_list(file):
     try:
         with open(file, 'r', encoding='utf-8') as file:
@@ -15,7 +36,193 @@ def text_to_list(file):
         print(f"An error occurred while reading the file: {e}")
         return []  # Return an empty list on other errors as well
 
+def _open_binary(path):
+    """Opens path for binary reading, transparently decompressing gzip files."""
+    with open(path, 'rb') as raw:
+        magic = raw.read(2)
+    return gzip.open(path, 'rb') if magic == GZIP_MAGIC else open(path, 'rb')
+
+def _normalize(text):
+    # Collapse the whitespace left over from joined lines and indentation
+    return " ".join(text.split())
+
+def iter_records(file, record_start=None, start_offset=0, complete_lines=False, hold_last_record=False):
+    """
+    Lazily reads messages from a (possibly gzipped) trades file.
+
+    Without record_start every non-empty line is one message, as in
+    text_to_list. With record_start (a regex), a line that doesn't match it
+    is joined onto the previous message, so posts split over several lines
+    come out as one. The text record_start matched is the message header
+    (timestamp, author) and is left out of the message; use a lookahead
+    such as "^(?=\d)" to split on a pattern without dropping it.
+
+    Args:
+        file (str): Path to a plain or gzip compressed text file.
+        record_start (re.Pattern | str | None): Pattern matching the first line of a message.
+        start_offset (int): Byte offset (in the uncompressed text) to resume from.
+        complete_lines (bool): Stop before a final line without a newline, which a
+                               writer may still be in the middle of appending.
+        hold_last_record (bool): Don't yield the last multi-line message, since more
+                                 continuation lines may still follow.
+
+    Yields:
+        tuple: (message, end_offset), where end_offset is the byte offset just
+               after the message, i.e. where a resumed read should start.
+    """
+    if isinstance(record_start, str):
+        record_start = re.compile(record_start)
+
+    try:
+        with _open_binary(file) as f:
+            if start_offset:
+                f.seek(start_offset) # Gzip seeks decompress forward, still without holding the file in memory
+            offset = start_offset
+            parts = []
+            for raw_line in f:
+                if complete_lines and not raw_line.endswith(b"\n"):
+                    break
+                line = raw_line.decode('utf-8', errors='replace').rstrip()
+                if record_start is None:
+                    offset += len(raw_line)
+                    message = _normalize(line)
+                    if message:
+                        yield message, offset
+                    continue
+
+                header = record_start.match(line)
+                if header:
+                    if parts:
+                        message = _normalize(" ".join(parts))
+                        if message:
+                            yield message, offset # The previous message ends where this line starts
+                        parts = []
+                    line = line[header.end():]
+                parts.append(line)
+                offset += len(raw_line)
+
+            if parts and not hold_last_record:
+                message = _normalize(" ".join(parts))
+                if message:
+                    yield message, offset
+    except FileNotFoundError:
+        print(f"Error: File not found at {file}")
+    except (OSError, EOFError) as e:
+        print(f"An error occurred while reading the file: {e}")
+
+def iter_messages(file, record_start=None, start_offset=0):
+    """Same as iter_records, but yields only the message texts."""
+    for message, _ in iter_records(file, record_start, start_offset):
+        yield message
+
+
+class MessageStream:
+    """
+    Iterable of messages from a trades file that can resume after an interruption.
+
+    The byte offset of the last fully processed message is kept in a small
+    JSON checkpoint file next to the input. Iterating starts from that offset,
+    and commit(count) moves it forward once the consumer has durably handled
+    the first `count` messages yielded by this stream, e.g. from
+    tradereader.feeder's on_flush callback.
+
+    The checkpoint also stores a hash of the file's first bytes (up to the
+    checkpointed offset), so a checkpoint written for a different file with
+    the same name is ignored. A plain file that shrank below the checkpoint
+    was truncated and is read again from the start.
+    """
+
+    def __init__(self, file, checkpoint_path=None, record_start=None, complete_lines=False):
+        self.file = file
+        self.checkpoint_path = checkpoint_path or f"{file}.checkpoint"
+        self.record_start = record_start
+        self.complete_lines = complete_lines
+        self.yielded = 0
+        self.committed = 0
+        self.offset = 0
+        self.end_offsets = deque() # End offsets of yielded messages that aren't committed yet
+
+    def _fingerprint(self, length):
+        # Only bytes before the checkpoint are hashed, so a file that is still growing keeps its fingerprint
+        try:
+            with _open_binary(self.file) as f:
+                return hashlib.sha256(f.read(length)).hexdigest()
+        except (OSError, EOFError):
+            return None
+
+    def load_checkpoint(self):
+        """Returns the saved byte offset for this file, or 0 if there is none."""
+        try:
+            with open(self.checkpoint_path, 'r', encoding='utf-8') as f:
+                checkpoint = json.load(f)
+        except FileNotFoundError:
+            return 0
+        except (OSError, ValueError) as e:
+            print(f"Ignoring unreadable checkpoint {self.checkpoint_path}: {e}")
+            return 0
+
+        offset = checkpoint.get("offset", 0)
+        if checkpoint.get("fingerprint") != self._fingerprint(min(offset, FINGERPRINT_BYTES)):
+            print(f"Checkpoint {self.checkpoint_path} belongs to another file, starting from the beginning")
+            return 0
+        try:
+            with open(self.file, 'rb') as raw:
+                compressed = raw.read(2) == GZIP_MAGIC
+        except OSError:
+            return 0
+        if not compressed and os.path.getsize(self.file) < offset:
+            print(f"{self.file} was truncated, starting from the beginning")
+            return 0
+        return offset
+
+    def save_checkpoint(self, offset):
+        # Write then rename, so a crash never leaves a half written checkpoint behind
+        temp_path = f"{self.checkpoint_path}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump({"file": os.path.abspath(self.file), "offset": offset, "fingerprint": self._fingerprint(min(offset, FINGERPRINT_BYTES))}, f)
+        os.replace(temp_path, self.checkpoint_path)
+
+    def reset(self):
+        """Forgets the checkpoint so the next iteration starts from the beginning."""
+        try:
+            os.remove(self.checkpoint_path)
+        except FileNotFoundError:
+            pass
+
+    def __iter__(self):
+        return self.read()
+
+    def read(self, hold_last_record=False):
+        """
+        Yields the messages after the checkpoint. Each call starts over from
+        the current checkpoint, so it can be repeated on a file that grows.
+        """
+        previous_offset = self.offset
+        self.offset = self.load_checkpoint()
+        if self.offset and self.offset != previous_offset: # Only announce a resume, not every re-read
+            print(f"Resuming {self.file} from byte {self.offset}")
+        self.yielded = self.committed = 0
+        self.end_offsets.clear()
+        records = iter_records(self.file, self.record_start, self.offset,
+                               complete_lines=self.complete_lines, hold_last_record=hold_last_record)
+        for message, end_offset in records:
+            self.end_offsets.append(end_offset)
+            self.yielded += 1
+            yield message
+
+    def commit(self, count):
+        """
+        Marks the first `count` messages yielded since iteration started as
+        processed and persists the offset after the last of them.
+        """
+        count = min(count, self.yielded)
+        if count <= self.committed:
+            return
+        while self.committed < count:
+            self.offset = self.end_offsets.popleft()
+            self.committed += 1
+        self.save_checkpoint(self.offset)
+
 if __name__ == "__main__":
     print(text_to_list(trades_file))
     print(len(text_to_list(trades_file)))
-
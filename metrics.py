@@ -0,0 +1,198 @@
+#MÄTVÄRDEN (LATENS, RÄKNARE) I PROMETHEUS-FORMAT
+
+import bisect
+import math
+import os
+import threading
+import time
+from contextlib import nullcontext
+
+# Off unless METRICS_ENABLED=1. While off, timer() hands back a shared no-op
+# context manager and inc()/observe() return right away, so instrumented code
+# pays one global lookup per call. Collectors only run when /metrics is scraped.
+ENABLED = os.environ.get("METRICS_ENABLED") == "1"
+
+PREFIX = "tickettrader_"
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Upper bounds in seconds, from sub-millisecond SQLite reads to slow Gemini calls
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Every metric the modules record, with its type and help text
+METRICS = {
+    "llm_request_seconds": ("histogram", "Latency of Gemini requests, by kind (single or batch)."),
+    "llm_calls_total": ("counter", "Gemini requests sent, by kind."),
+    "llm_failures_total": ("counter", "Gemini requests that raised an error, by kind."),
+    "parse_failures_total": ("counter", "Gemini answers (or batch items) that failed schema validation, by kind."),
+    "rule_parser_hits_total": ("counter", "Messages the local rule parser answered without Gemini."),
+    "rate_limiter_wait_seconds": ("histogram", "Time calls waited for a rate limiter slot."),
+    "db_connect_seconds": ("histogram", "Time to open and configure a SQLite connection, by database."),
+    "db_query_seconds": ("histogram", "Duration of database operations, by operation."),
+    "ratio_stage_seconds": ("histogram", "Duration of ratiocalc stages, by stage."),
+    "ratio_cache_load_seconds": ("histogram", "Time to (re)load a cached ratio table in interact, by table."),
+    "ratio_cache_hits_total": ("counter", "Ratio cache lookups answered from memory."),
+    "ratio_cache_misses_total": ("counter", "Ratio cache lookups that reloaded from the database."),
+    "ratio_cache_hit_ratio": ("gauge", "Share of ratio cache lookups answered from memory."),
+    "extraction_cache_hits_total": ("counter", "Messages answered from the extraction cache."),
+    "extraction_cache_misses_total": ("counter", "Extraction cache lookups that found nothing."),
+    "rate_limiter_calls_total": ("counter", "Calls that passed through the Gemini rate limiter."),
+    "rate_limiter_throttled_total": ("counter", "Calls the Gemini rate limiter made wait."),
+    "rate_limiter_tokens": ("gauge", "Calls that could start right now without waiting."),
+    "http_request_seconds": ("histogram", "Flask request latency, by endpoint and status."),
+    "api_errors_total": ("counter", "Error responses returned by the API, by error type."),
+}
+
+_lock = threading.Lock()
+_counters = {} # (name, labels) -> value
+_histograms = {} # (name, labels) -> [bucket counts..., +Inf count, sum]
+_collectors = []
+
+def enable(enabled=True):
+    """Turns recording on or off at runtime (the METRICS_ENABLED default is read at import)."""
+    global ENABLED
+    ENABLED = enabled
+
+def _key(name, labels):
+    return name, tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+def inc(name, amount=1, **labels):
+    """Adds amount to a counter."""
+    if not ENABLED:
+        return
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + amount
+
+def observe(name, value, **labels):
+    """Records one value (seconds) in a histogram."""
+    if not ENABLED:
+        return
+    key = _key(name, labels)
+    index = bisect.bisect_left(DEFAULT_BUCKETS, value)
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = [0] * (len(DEFAULT_BUCKETS) + 1) + [0.0]
+        histogram[index] += 1
+        histogram[-1] += value
+
+
+class _Timer:
+    __slots__ = ("name", "labels", "started")
+
+    def __init__(self, name, labels):
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        observe(self.name, time.perf_counter() - self.started, **self.labels)
+        return False
+
+_NULL_TIMER = nullcontext()
+
+def timer(name, **labels):
+    """Context manager recording the duration of its block in a histogram."""
+    if not ENABLED:
+        return _NULL_TIMER
+    return _Timer(name, labels)
+
+def register_collector(collector):
+    """
+    Adds a function called on every scrape. It returns (name, type, labels,
+    value) tuples for values another module already tracks, such as cache
+    hit counts, so they cost nothing between scrapes.
+    """
+    _collectors.append(collector)
+
+def reset():
+    """Clears every recorded counter and histogram."""
+    with _lock:
+        _counters.clear()
+        _histograms.clear()
+
+def _escape(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in pairs) + "}"
+
+def _format_value(value):
+    if value is None:
+        return "NaN"
+    if isinstance(value, float) and math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+def render():
+    """Returns every metric in the Prometheus text exposition format."""
+    with _lock:
+        counters = dict(_counters)
+        histograms = {key: list(value) for key, value in _histograms.items()}
+
+    samples = {} # name -> (type, [(labels, value)])
+    for (name, labels), value in counters.items():
+        samples.setdefault(name, ("counter", []))[1].append((labels, value))
+    for collector in _collectors:
+        try:
+            for name, metric_type, labels, value in collector():
+                samples.setdefault(name, (metric_type, []))[1].append((_key(name, labels)[1], value))
+        except Exception as e:
+            print(f"Metrics collector {collector.__name__} failed: {e}")
+
+    lines = []
+    for name in sorted(set(samples) | {name for name, _ in histograms}):
+        metric_type, help_text = METRICS.get(name, (samples.get(name, ("gauge",))[0], ""))
+        full_name = PREFIX + name
+        if help_text:
+            lines.append(f"# HELP {full_name} {help_text}")
+        lines.append(f"# TYPE {full_name} {metric_type}")
+        if metric_type == "histogram":
+            for (histogram_name, labels), histogram in sorted(histograms.items()):
+                if histogram_name != name:
+                    continue
+                cumulative = 0
+                for bound, count in zip(DEFAULT_BUCKETS + (math.inf,), histogram[:-1]):
+                    cumulative += count
+                    le = "+Inf" if math.isinf(bound) else repr(bound)
+                    lines.append(f"{full_name}_bucket{_format_labels(labels, [('le', le)])} {cumulative}")
+                lines.append(f"{full_name}_sum{_format_labels(labels)} {_format_value(histogram[-1])}")
+                lines.append(f"{full_name}_count{_format_labels(labels)} {cumulative}")
+        else:
+            for labels, value in sorted(samples.get(name, (None, []))[1], key=lambda sample: sample[0]):
+                lines.append(f"{full_name}{_format_labels(labels)} {_format_value(value)}")
+    return "\n".join(lines) + "\n"
+
+def start_http_server(port, host="0.0.0.0"):
+    """
+    Serves /metrics from a background thread, for processes without a Flask
+    app such as the tradereader ingest loop. Returns the server.
+    """
+    # http.server pulls in email, ssl and socketserver; every module imports
+    # metrics, so it is only loaded by the processes that actually serve it
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", CONTENT_TYPE)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass # Scrapes every few seconds would drown the ingest output
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
@@ -1,41 +1,148 @@
 #BEGRÄNSAR REQUESTSEN TILL GEMINI API
 #GRÄNS: 15 RPM
 
+import bisect
 import time
 from collections import deque
 import threading
+import metrics
 
-class RateLimiter:
-    def __init__(self, max_calls, time_window):
-        self.max_calls = max_calls
-        self.time_window = time_window
-        self.call_times = deque()
+# Upper bounds (seconds) of the wait-time histogram buckets, the last bucket is open ended
+WAIT_BUCKETS = (0.0, 0.1, 0.5, 1.0, 5.0, 15.0, 30.0, 60.0)
+
+class _BaseRateLimiter:
+    """
+    Shared blocking/async front end for the limiters below.
+
+    Subclasses implement _reserve(now), which claims the next free slot under
+    the lock and returns how long the caller has to wait for it, and
+    _tokens(now), the number of calls that could start immediately. The wait
+    itself happens outside the lock, so other threads can reserve their own
+    slots in the meantime instead of queueing behind a sleeping thread.
+    """
+
+    def __init__(self):
         self.lock = threading.Lock()  # Use a lock for thread safety
+        self.total_calls = 0
+        self.throttled_calls = 0
+        self.total_wait = 0.0
+        self.wait_histogram = [0] * (len(WAIT_BUCKETS) + 1)
+
+    def _reserve(self, now):
+        raise NotImplementedError
+
+    def _tokens(self, now):
+        raise NotImplementedError
+
+    def current_tokens(self):
+        """Number of calls that could start right now without waiting."""
+        with self.lock:
+            return self._tokens(time.monotonic())
+
+    def _acquire(self):
+        with self.lock:
+            wait_time = self._reserve(time.monotonic())
+            self.total_calls += 1
+            if wait_time > 0:
+                self.throttled_calls += 1
+                self.total_wait += wait_time
+            self.wait_histogram[bisect.bisect_left(WAIT_BUCKETS, wait_time)] += 1
+        metrics.observe("rate_limiter_wait_seconds", wait_time)
+        if wait_time > 0:
+            print(f"Rate limit exceeded. Waiting {wait_time:.2f} seconds.")
+        return wait_time
 
     def check(self):
         """
-        Checks if a new call is allowed.  If allowed, records the current time.
-        If not allowed, it waits until the next call is allowed.
+        Reserves a slot for a new call and blocks until that slot is reached.
         This function is thread-safe.
 
         Returns:
-            None:  It either allows the call (and records the time) or waits.
+            None:  It either allows the call immediately or waits.
         """
-        with self.lock:  # Acquire the lock
-            current_time = time.time()
-            # Remove calls that are outside the time window
-            while self.call_times and self.call_times[0] <= current_time - self.time_window:
-                self.call_times.popleft()
-
-            # Check if we've reached the limit
-            if len(self.call_times) < self.max_calls:
-                self.call_times.append(current_time)  # Record the time of this call
-                return  # Allow the call
-            else:
-                # Wait until the next call is allowed
-                wait_time = self.call_times[0] - (current_time - self.time_window)
-                print(f"Rate limit exceeded. Waiting {wait_time:.2f} seconds.")
-                time.sleep(wait_time)
-                self.call_times.append(time.time())  # Add current time after waiting
-                return  # Allow the call after waiting
+        wait_time = self._acquire()
+        if wait_time > 0:
+            time.sleep(wait_time)
+
+    async def acheck(self):
+        """Async version of check(): awaits the reserved slot without blocking the event loop."""
+        wait_time = self._acquire()
+        if wait_time > 0:
+            import asyncio # Only async callers need it, keeps it out of every import of this module
+            await asyncio.sleep(wait_time)
+
+    def stats(self):
+        """Returns current tokens, call/throttle counts and the wait-time histogram."""
+        with self.lock:
+            labels = [f"<={bound:g}s" for bound in WAIT_BUCKETS] + [f">{WAIT_BUCKETS[-1]:g}s"]
+            return {
+                "current_tokens": self._tokens(time.monotonic()),
+                "total_calls": self.total_calls,
+                "throttled_calls": self.throttled_calls,
+                "total_wait_seconds": round(self.total_wait, 3),
+                "wait_histogram": dict(zip(labels, self.wait_histogram)),
+            }
+
+
+class RateLimiter(_BaseRateLimiter):
+    """Sliding window: at most max_calls calls start within any time_window seconds."""
+
+    def __init__(self, max_calls, time_window):
+        super().__init__()
+        self.max_calls = max_calls
+        self.time_window = time_window
+        self.call_times = deque()  # Start times of calls, including reserved future ones
+
+    def _prune(self, now):
+        # Remove calls that are outside the time window
+        while self.call_times and self.call_times[0] <= now - self.time_window:
+            self.call_times.popleft()
+
+    def _reserve(self, now):
+        self._prune(now)
+        if len(self.call_times) < self.max_calls:
+            slot = now
+        else:
+            # The call max_calls back has to leave the window before this one may start
+            slot = max(now, self.call_times[-self.max_calls] + self.time_window)
+        self.call_times.append(slot)
+        return slot - now
+
+    def _tokens(self, now):
+        self._prune(now)
+        return max(0, self.max_calls - len(self.call_times))
+
+
+class TokenBucketRateLimiter(_BaseRateLimiter):
+    """
+    Token bucket: refills `rate` tokens per second up to `capacity`, so up to
+    `capacity` calls can burst at once while the long-run rate stays at `rate`.
+    A call that finds the bucket empty borrows a future token and waits for it.
+    """
+
+    def __init__(self, rate, capacity):
+        super().__init__()
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+
+    @classmethod
+    def per_window(cls, max_calls, time_window, capacity=None):
+        """Builds a bucket with the same long-run rate as RateLimiter(max_calls, time_window)."""
+        return cls(rate=max_calls / time_window, capacity=capacity if capacity is not None else max_calls)
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def _reserve(self, now):
+        self._refill(now)
+        self.tokens -= 1
+        if self.tokens >= 0:
+            return 0.0
+        return -self.tokens / self.rate  # Time until the borrowed token has been refilled
 
+    def _tokens(self, now):
+        self._refill(now)
+        return round(max(0.0, self.tokens), 3)
@@ -1,159 +1,474 @@
 #BERÄKNA RATION MELLAN TRADESEN OCH LAGRA DEN DATAN
 
 import sqlite3
+import sys
+import math
+import time
 import itertools
 from collections import defaultdict
-import statistics # For calculating the mean
-from tradestorer import *
+from operator import itemgetter
+from tradestorer import reset_pair_stats, get_trades_connection
+from database import get_connection
+import tickettypes
+import ratiosnapshot
+import metrics
 
 TRADE_DATABASE_NAME = 'ticket_trades.db'
 RATIO_DATABASE_NAME = "ticket_trades_ratios.db"
 
+# --- Pair Aggregation ---
+def _new_pair_stats():
+    # Dictionary to store aggregated stats for each PAIR of ticket types.
+    # We use a canonical key (sorted tuple) to treat (A, B) and (B, A) trades
+    # as affecting the same underlying pair relationship.
+    # Stores total quantities exchanged FOR THAT PAIR ONLY.
+    return defaultdict(lambda: {
+        'total_type1_exchanged': 0, # Total quantity of the first type in the sorted pair key
+        'total_type2_exchanged': 0, # Total quantity of the second type in the sorted pair key
+        'trade_count': 0            # Number of direct trades between these two types
+    })
+
+def _aggregate_trades(trades, pair_exchange_stats, grouped=False):
+    """
+    Adds (oq, ot, rq, rt) trade rows into pair_exchange_stats in place.
+    With grouped=True the rows are (group, oq, ot, rq, rt) and the stats are
+    keyed (group, type1, type2), so every group is summed in the same pass.
+    """
+    rows = trades if grouped else ((None, *trade) for trade in trades)
+    for group, oq, ot, rq, rt in rows:
+        # Types are already canonical (tradestorer normalizes them at ingest), so no cleaning here
+        if not ot or not rt or ot == rt:
+            # Skip trades with invalid types or trades of a type for itself
+            if ot == rt and ot:
+                print(f"Warning: Skipping self-trade: {oq} {ot} -> {rq} {rt}")
+            else:
+                print(f"Warning: Skipping trade with invalid types: {oq} {ot} -> {rq} {rt}")
+            continue
+
+        # Create canonical key (sorted tuple) for the pair, type1 is alphabetically first
+        if ot < rt:
+            stats = pair_exchange_stats[(group, ot, rt) if grouped else (ot, rt)]
+            stats['total_type1_exchanged'] += oq # Trade was Type1 offered for Type2 requested
+            stats['total_type2_exchanged'] += rq
+        else:
+            stats = pair_exchange_stats[(group, rt, ot) if grouped else (rt, ot)]
+            stats['total_type1_exchanged'] += rq # Type2 offered for Type1, rq is Type1 here
+            stats['total_type2_exchanged'] += oq
+        stats['trade_count'] += 1
+    return pair_exchange_stats
+
+def _aggregate_trades_numpy(trades, pair_exchange_stats, grouped=False):
+    """
+    Vectorized equivalent of _aggregate_trades, producing identical totals.
+
+    Ticket type strings (and groups) are interned once per distinct value,
+    every trade is mapped to integer codes, and the totals are accumulated per
+    distinct (group, type1, type2) code with np.add.at (which sums in row
+    order, like the Python loop) in a single pass over all trades.
+    """
+    try:
+        import numpy as np # Only needed for this engine, so it isn't imported with the module
+    except ImportError as e:
+        raise ImportError("engine='numpy' needs NumPy (pip install -r requirements.txt); "
+                          "use engine='python' without it") from e
+
+    if not trades:
+        return pair_exchange_stats
+    # zip(*trades) is much slower than one itemgetter pass per column for millions of rows
+    columns = [list(map(itemgetter(column), trades)) for column in range(5 if grouped else 4)]
+    groups, group_codes = [None], np.zeros(len(trades), dtype=np.int64)
+    if grouped:
+        group_col = columns.pop(0)
+        groups = list(dict.fromkeys(group_col))
+        group_index = {group: code for code, group in enumerate(groups)}
+        group_codes = np.fromiter(map(group_index.__getitem__, group_col), dtype=np.int64, count=len(trades))
+    oq_col, ot_col, rq_col, rt_col = columns
+    offered_quantities = np.array(oq_col)
+    requested_quantities = np.array(rq_col)
+
+    # Intern type strings to codes, then map each code to its position among the sorted names.
+    # Types are already canonical from ingest, only empty ones are dropped.
+    type_col = ot_col + rt_col
+    raw_types = list(dict.fromkeys(type_col))
+    interned = {raw: code for code, raw in enumerate(raw_types)}
+    raw_codes = np.fromiter(map(interned.__getitem__, type_col), dtype=np.int64, count=len(type_col))
+    cleaned = [raw or None for raw in raw_types]
+    clean_names = sorted({name for name in cleaned if name})
+    # Codes follow alphabetical order, so code order == the sorted canonical pair order
+    clean_code = {name: code for code, name in enumerate(clean_names)}
+    raw_to_clean = np.array([clean_code[name] if name else -1 for name in cleaned], dtype=np.int64)
+    codes = raw_to_clean[raw_codes]
+    offered_codes = codes[:len(trades)]
+    requested_codes = codes[len(trades):]
+
+    valid = (offered_codes >= 0) & (requested_codes >= 0) & (offered_codes != requested_codes)
+    for index in np.flatnonzero(~valid):
+        oq, ot, rq, rt = trades[index][-4:]
+        ot_clean = cleaned[raw_codes[index]]
+        rt_clean = cleaned[raw_codes[len(trades) + index]]
+        # Skip trades with invalid types or trades of a type for itself
+        if ot_clean == rt_clean and ot_clean is not None:
+            print(f"Warning: Skipping self-trade: {oq} {ot_clean} -> {rq} {rt_clean}")
+        else:
+            print(f"Warning: Skipping trade with invalid types: {oq} {ot} -> {rq} {rt}")
+
+    group_codes = group_codes[valid]
+    offered_codes = offered_codes[valid]
+    requested_codes = requested_codes[valid]
+    offered_quantities = offered_quantities[valid]
+    requested_quantities = requested_quantities[valid]
+
+    # type1 is the alphabetically first type of the pair, exactly like the sorted tuple key
+    offered_first = offered_codes < requested_codes
+    type1_codes = np.where(offered_first, offered_codes, requested_codes)
+    type2_codes = np.where(offered_first, requested_codes, offered_codes)
+    type1_quantities = np.where(offered_first, offered_quantities, requested_quantities)
+    type2_quantities = np.where(offered_first, requested_quantities, offered_quantities)
+
+    # One flat code per (group, type1, type2); only the combinations that occur get a slot
+    type_count = len(clean_names)
+    keys, slots = np.unique((group_codes * type_count + type1_codes) * type_count + type2_codes, return_inverse=True)
+    total_type1 = np.zeros(len(keys), dtype=type1_quantities.dtype)
+    total_type2 = np.zeros(len(keys), dtype=type2_quantities.dtype)
+    trade_counts = np.zeros(len(keys), dtype=np.int64)
+    np.add.at(total_type1, slots, type1_quantities)
+    np.add.at(total_type2, slots, type2_quantities)
+    np.add.at(trade_counts, slots, 1)
+
+    key_groups, key_pairs = np.divmod(keys, type_count * type_count)
+    key_type1, key_type2 = np.divmod(key_pairs, type_count)
+    for group_code, type1_code, type2_code, total1, total2, trade_count in zip(
+            key_groups.tolist(), key_type1.tolist(), key_type2.tolist(),
+            total_type1.tolist(), total_type2.tolist(), trade_counts.tolist()):
+        pair_key = (clean_names[type1_code], clean_names[type2_code])
+        stats = pair_exchange_stats[(groups[group_code], *pair_key) if grouped else pair_key]
+        stats['total_type1_exchanged'] += total1
+        stats['total_type2_exchanged'] += total2
+        stats['trade_count'] += trade_count
+    return pair_exchange_stats
+
+# Aggregation engines selectable with engine=... (or --engine=numpy on the command line)
+AGGREGATION_ENGINES = {
+    'python': _aggregate_trades,
+    'numpy': _aggregate_trades_numpy,
+}
+DEFAULT_ENGINE = 'python'
+
+def _ratios_from_pair_stats(pair_exchange_stats):
+    """Turns aggregated pair totals into {(type_a, type_b): stats} in both directions."""
+    relative_values = {}
+
+    unique_types = set()
+    for type1, type2 in pair_exchange_stats.keys():
+        unique_types.add(type1)
+        unique_types.add(type2)
+
+    # Iterate through the unique types to ensure all pairs are considered,
+    # even if one direction of trade never occurred but stats were added via the canonical key.
+    unique_types_list = sorted(list(unique_types))
+    for type_a, type_b in itertools.combinations(unique_types_list, 2):
+         # Use the canonical key to fetch stats
+        pair_key = tuple(sorted((type_a, type_b)))
+        type1, type2 = pair_key
+
+        if pair_key in pair_exchange_stats:
+            stats = pair_exchange_stats[pair_key]
+            total_type1 = stats['total_type1_exchanged']
+            total_type2 = stats['total_type2_exchanged']
+            trade_count = stats['trade_count']
+
+            # Determine which total corresponds to type_a and type_b
+            total_a = total_type1 if type_a == type1 else total_type2
+            total_b = total_type2 if type_b == type2 else total_type1 # Or simply the other one
+
+            # Calculate Value(A) / Value(B) => How many B per A = Total B / Total A
+            if total_a > 0:
+                ratio_a_div_b = total_b / total_a
+                relative_values[(type_a, type_b)] = {
+                    'average_ratio': ratio_a_div_b,
+                    'trade_count': trade_count
+                }
+            else:
+                # Cannot determine ratio if no A was ever exchanged for B
+                 relative_values[(type_a, type_b)] = {
+                    'average_ratio': None, # Or float('inf') or 0 depending on desired handling
+                    'trade_count': trade_count
+                }
+
+            # Calculate Value(B) / Value(A) => How many A per B = Total A / Total B
+            if total_b > 0:
+                ratio_b_div_a = total_a / total_b
+                relative_values[(type_b, type_a)] = {
+                    'average_ratio': ratio_b_div_a,
+                    'trade_count': trade_count
+                }
+            else:
+                # Cannot determine ratio if no B was ever exchanged for A
+                 relative_values[(type_b, type_a)] = {
+                    'average_ratio': None, # Or float('inf') or 0
+                    'trade_count': trade_count
+                }
+
+    return relative_values
+
+# --- Time Buckets ---
+# Trades are also summed per BUCKET_SECONDS time bucket so rolling windows and
+# decay weights are computed from a few hundred partial sums, not a table scan.
+BUCKET_SECONDS = 900
+WINDOWS = {'1h': 3600, '24h': 86400, '7d': 7 * 86400}
+DECAY_WINDOW = 'decay'
+DECAY_HALF_LIFE = 86400 # A trade's weight halves every day
+DECAY_HORIZON = 10 * DECAY_HALF_LIFE # Older buckets weigh < 0.1% and are ignored
+BUCKET_RETENTION = 30 * 86400 # Buckets older than this are pruned
+
+def update_pair_exchange_stats(full_rebuild=False, engine=DEFAULT_ENGINE):
+    """
+    Folds trades added since the last run into the persisted pair_exchange_stats
+    and pair_exchange_buckets tables, using the rowid high-water mark in
+    pair_stats_state. Cost is proportional to the number of new trades, not
+    the whole history.
+
+    Args:
+        full_rebuild (bool): Discard the stored aggregates and rebuild them from
+                             every row in ticket_trades.
+        engine (str): Aggregation engine, a key of AGGREGATION_ENGINES.
+
+    Returns:
+        int: Number of new trade rows that were read.
+    """
+    aggregate = AGGREGATION_ENGINES[engine]
+    conn = get_trades_connection()
+    try:
+        cursor = conn.cursor()
+        # Take the write lock before reading the high-water mark, so two
+        # refreshes running at once (a follow loop and a manual run) can't
+        # both fold in the same new rows
+        cursor.execute("BEGIN IMMEDIATE")
+        if full_rebuild:
+            reset_pair_stats(cursor)
+
+        cursor.execute("SELECT last_rowid FROM pair_stats_state WHERE id = 0")
+        last_rowid = cursor.fetchone()[0]
+        cursor.execute("SELECT MAX(rowid) FROM ticket_trades")
+        max_rowid = cursor.fetchone()[0] or 0
+        if max_rowid <= last_rowid:
+            conn.commit()
+            return 0
+
+        # Fetch new trades, ensuring quantities are positive and types are valid
+        cursor.execute("""
+            SELECT CAST(strftime('%s', timestamp) AS INTEGER) / ? * ?,
+                   offered_quantity, offered_ticket_type, requested_quantity, requested_ticket_type
+            FROM ticket_trades
+            WHERE rowid > ? AND rowid <= ?
+              AND offered_quantity > 0 AND requested_quantity > 0
+              AND offered_ticket_type IS NOT NULL AND offered_ticket_type != ''
+              AND requested_ticket_type IS NOT NULL AND requested_ticket_type != ''
+        """, (BUCKET_SECONDS, BUCKET_SECONDS, last_rowid, max_rowid))
+        with metrics.timer("db_query_seconds", operation="fetch_new_trades"):
+            new_trades = cursor.fetchall()
+
+        # Aggregate per (time bucket, pair) in one pass; the all-time delta is the sum of the buckets
+        delta = _new_pair_stats()
+        bucket_rows = []
+        with metrics.timer("ratio_stage_seconds", stage="aggregate", engine=engine):
+            for (bucket_start, *pair_key), stats in aggregate(new_trades, _new_pair_stats(), grouped=True).items():
+                for field, value in stats.items():
+                    delta[tuple(pair_key)][field] += value
+                if bucket_start is not None: # Unparseable timestamps only count towards all-time totals
+                    bucket_rows.append((bucket_start, *pair_key, stats['total_type1_exchanged'],
+                                        stats['total_type2_exchanged'], stats['trade_count']))
+
+        cursor.executemany("""
+            INSERT INTO pair_exchange_stats (type1, type2, total_type1_exchanged, total_type2_exchanged, trade_count)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT(type1, type2) DO UPDATE SET
+                total_type1_exchanged = total_type1_exchanged + excluded.total_type1_exchanged,
+                total_type2_exchanged = total_type2_exchanged + excluded.total_type2_exchanged,
+                trade_count = trade_count + excluded.trade_count
+        """, [(type1, type2, stats['total_type1_exchanged'], stats['total_type2_exchanged'], stats['trade_count'])
+              for (type1, type2), stats in delta.items()])
+        cursor.executemany("""
+            INSERT INTO pair_exchange_buckets (bucket_start, type1, type2, total_type1_exchanged, total_type2_exchanged, trade_count)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT(bucket_start, type1, type2) DO UPDATE SET
+                total_type1_exchanged = total_type1_exchanged + excluded.total_type1_exchanged,
+                total_type2_exchanged = total_type2_exchanged + excluded.total_type2_exchanged,
+                trade_count = trade_count + excluded.trade_count
+        """, bucket_rows)
+        cursor.execute("DELETE FROM pair_exchange_buckets WHERE bucket_start < ?", (int(time.time()) - BUCKET_RETENTION,))
+        cursor.execute("UPDATE pair_stats_state SET last_rowid = ? WHERE id = 0", (max_rowid,))
+        conn.commit()
+        return len(new_trades)
+    except Exception:
+        conn.rollback()
+        raise
+
+def calculate_windowed_values(window, now=None):
+    """
+    Calculates ratios like calculate_relative_values, but only from recent
+    trades, using the per-bucket partial sums kept by update_pair_exchange_stats.
+
+    Args:
+        window (str): A key of WINDOWS ('1h', '24h', '7d') for a rolling window,
+                      or 'decay' to weight every bucket by 0.5 ** (age / DECAY_HALF_LIFE).
+                      Windows are aligned to BUCKET_SECONDS, so they can reach
+                      up to one bucket further back than their nominal length.
+        now (float): Reference epoch time, defaults to the current time.
+
+    Returns:
+        dict: Same shape as calculate_relative_values(). trade_count is the
+              plain number of trades inside the window / decay horizon.
+    """
+    if window != DECAY_WINDOW and window not in WINDOWS:
+        raise ValueError(f"Unknown window '{window}', expected one of {', '.join(list(WINDOWS) + [DECAY_WINDOW])}")
+    now = time.time() if now is None else now
+    span = DECAY_HORIZON if window == DECAY_WINDOW else WINDOWS[window]
+    cutoff = int(now - span) // BUCKET_SECONDS * BUCKET_SECONDS
+
+    conn = get_trades_connection()
+    cursor = conn.cursor()
+    pair_exchange_stats = _new_pair_stats()
+    if window == DECAY_WINDOW:
+        cursor.execute("""
+            SELECT bucket_start, type1, type2, total_type1_exchanged, total_type2_exchanged, trade_count
+            FROM pair_exchange_buckets
+            WHERE bucket_start >= ?
+        """, (cutoff,))
+        for bucket_start, type1, type2, total1, total2, trade_count in cursor.fetchall():
+            # Age measured from the middle of the bucket
+            weight = 0.5 ** (max(now - bucket_start - BUCKET_SECONDS / 2, 0) / DECAY_HALF_LIFE)
+            stats = pair_exchange_stats[(type1, type2)]
+            stats['total_type1_exchanged'] += total1 * weight
+            stats['total_type2_exchanged'] += total2 * weight
+            stats['trade_count'] += trade_count
+    else:
+        cursor.execute("""
+            SELECT type1, type2, SUM(total_type1_exchanged), SUM(total_type2_exchanged), SUM(trade_count)
+            FROM pair_exchange_buckets
+            WHERE bucket_start >= ?
+            GROUP BY type1, type2
+        """, (cutoff,))
+        for type1, type2, total1, total2, trade_count in cursor.fetchall():
+            pair_exchange_stats[(type1, type2)] = {
+                'total_type1_exchanged': total1,
+                'total_type2_exchanged': total2,
+                'trade_count': trade_count
+            }
+    return _ratios_from_pair_stats(pair_exchange_stats)
+
+def load_pair_exchange_stats():
+    """Reads the persisted pair aggregates into the same dict shape _aggregate_trades builds."""
+    conn = get_trades_connection()
+    cursor = conn.cursor()
+    cursor.execute("""
+        SELECT type1, type2, total_type1_exchanged, total_type2_exchanged, trade_count
+        FROM pair_exchange_stats
+    """)
+    pair_exchange_stats = _new_pair_stats()
+    for type1, type2, total1, total2, trade_count in cursor.fetchall():
+        pair_exchange_stats[(type1, type2)] = {
+            'total_type1_exchanged': total1,
+            'total_type2_exchanged': total2,
+            'trade_count': trade_count
+        }
+    return pair_exchange_stats
+
 # --- Ratio Calculation Function ---
-def calculate_relative_values():
+def calculate_relative_values(full_rebuild=False, engine=DEFAULT_ENGINE):
     """
     Calculates the relative value between ticket types based on the total
     quantities exchanged in historical trades involving only those two types.
     This provides a quantity-weighted average ratio.
 
+    Only trades added since the previous run are aggregated; the running
+    totals live in the pair_exchange_stats table.
+
+    Args:
+        full_rebuild (bool): Recompute the aggregates from every stored trade
+                             instead of the incremental delta.
+        engine (str): 'python' or 'numpy' (vectorized, same results, needs NumPy).
+
     Returns:
         dict: A dictionary where keys are tuples (Type A, Type B) and
               values are dictionaries containing 'average_ratio' (Value A / Value B)
               and 'trade_count'. Returns None if an error occurs.
               Returns an empty dict if no valid trades are found.
+
+    Raises:
+        ValueError: For an unknown engine.
+        ImportError: For engine='numpy' when NumPy isn't installed.
     """
-    conn = None
-    relative_values = {}
+    if engine not in AGGREGATION_ENGINES:
+        raise ValueError(f"Unknown engine '{engine}', expected one of {', '.join(AGGREGATION_ENGINES)}")
     try:
-        conn = sqlite3.connect(TRADE_DATABASE_NAME)
-        cursor = conn.cursor()
-        # Fetch trades, ensuring quantities are positive and types are valid
-        cursor.execute("""
-            SELECT offered_quantity, offered_ticket_type, requested_quantity, requested_ticket_type
-            FROM ticket_trades
-            WHERE offered_quantity > 0 AND requested_quantity > 0
-              AND offered_ticket_type IS NOT NULL AND offered_ticket_type != ''
-              AND requested_ticket_type IS NOT NULL AND requested_ticket_type != ''
-        """)
-        all_trades = cursor.fetchall()
+        update_pair_exchange_stats(full_rebuild=full_rebuild, engine=engine)
+        pair_exchange_stats = load_pair_exchange_stats()
 
-        if not all_trades:
+        if not pair_exchange_stats:
             print("No valid trade data found in the database.")
             return {}
 
-        # --- NEW LOGIC START ---
-
-        # Dictionary to store aggregated stats for each PAIR of ticket types.
-        # We use a canonical key (sorted tuple) to treat (A, B) and (B, A) trades
-        # as affecting the same underlying pair relationship.
-        # Stores total quantities exchanged FOR THAT PAIR ONLY.
-        pair_exchange_stats = defaultdict(lambda: {
-            'total_type1_exchanged': 0, # Total quantity of the first type in the sorted pair key
-            'total_type2_exchanged': 0, # Total quantity of the second type in the sorted pair key
-            'trade_count': 0            # Number of direct trades between these two types
-        })
-
-        unique_types = set() # Still need to know all types involved
-
-        # 1. Aggregate exchange quantities for each pair
-        for oq, ot, rq, rt in all_trades:
-            # Clean types for consistency
-            ot_clean = ot.strip().upper() if ot else None
-            rt_clean = rt.strip().upper() if rt else None
-
-            if not ot_clean or not rt_clean or ot_clean == rt_clean:
-                # Skip trades with invalid types or trades of a type for itself
-                if ot_clean == rt_clean and ot_clean is not None:
-                    print(f"Warning: Skipping self-trade: {oq} {ot_clean} -> {rq} {rt_clean}")
-                else:
-                    print(f"Warning: Skipping trade with invalid types: {oq} {ot} -> {rq} {rt}")
-                continue
-
-            # Add types to the set for later iteration if needed
-            unique_types.add(ot_clean)
-            unique_types.add(rt_clean)
-
-            # Create canonical key (sorted tuple) for the pair
-            pair_key = tuple(sorted((ot_clean, rt_clean)))
-            type1, type2 = pair_key # type1 is alphabetically first
-
-            # Add quantities to the correct bucket based on the canonical key
-            if ot_clean == type1: # Trade was Type1 offered for Type2 requested (Type1 -> Type2)
-                pair_exchange_stats[pair_key]['total_type1_exchanged'] += oq
-                pair_exchange_stats[pair_key]['total_type2_exchanged'] += rq
-            else: # Trade was Type2 offered for Type1 requested (Type2 -> Type1)
-                pair_exchange_stats[pair_key]['total_type1_exchanged'] += rq # rq is Type1 here
-                pair_exchange_stats[pair_key]['total_type2_exchanged'] += oq # oq is Type2 here
-
-            pair_exchange_stats[pair_key]['trade_count'] += 1
-
-        # 2. Calculate final ratios from aggregated stats
-        relative_values = {}
-        processed_pairs = set() # To avoid adding inverse if already processed
-
-        # Iterate through the unique types to ensure all pairs are considered,
-        # even if one direction of trade never occurred but stats were added via the canonical key.
-        unique_types_list = sorted(list(unique_types))
-        for type_a, type_b in itertools.combinations(unique_types_list, 2):
-             # Use the canonical key to fetch stats
-            pair_key = tuple(sorted((type_a, type_b)))
-            type1, type2 = pair_key
-
-            if pair_key in pair_exchange_stats:
-                stats = pair_exchange_stats[pair_key]
-                total_type1 = stats['total_type1_exchanged']
-                total_type2 = stats['total_type2_exchanged']
-                trade_count = stats['trade_count']
-
-                # Determine which total corresponds to type_a and type_b
-                total_a = total_type1 if type_a == type1 else total_type2
-                total_b = total_type2 if type_b == type2 else total_type1 # Or simply the other one
-
-                # Calculate Value(A) / Value(B) => How many B per A = Total B / Total A
-                if total_a > 0:
-                    ratio_a_div_b = total_b / total_a
-                    relative_values[(type_a, type_b)] = {
-                        'average_ratio': ratio_a_div_b,
-                        'trade_count': trade_count
-                    }
-                else:
-                    # Cannot determine ratio if no A was ever exchanged for B
-                     relative_values[(type_a, type_b)] = {
-                        'average_ratio': None, # Or float('inf') or 0 depending on desired handling
-                        'trade_count': trade_count
-                    }
-
-                # Calculate Value(B) / Value(A) => How many A per B = Total A / Total B
-                if total_b > 0:
-                    ratio_b_div_a = total_a / total_b
-                    relative_values[(type_b, type_a)] = {
-                        'average_ratio': ratio_b_div_a,
-                        'trade_count': trade_count
-                    }
-                else:
-                    # Cannot determine ratio if no B was ever exchanged for A
-                     relative_values[(type_b, type_a)] = {
-                        'average_ratio': None, # Or float('inf') or 0
-                        'trade_count': trade_count
-                    }
-
-        # --- NEW LOGIC END ---
-
-        return relative_values
+        return _ratios_from_pair_stats(pair_exchange_stats)
 
     except sqlite3.Error as e:
         print(f"Database error during calculation in '{TRADE_DATABASE_NAME}': {e}")
         return None # Indicate error
+    except ImportError:
+        raise # A setup problem, not bad data: don't let it pass as "no ratios"
     except Exception as e:
         print(f"Error calculating relative values: {e}")
         return None # Indicate error
-    finally:
-        if conn:
-            conn.close()
 
+def verify_pair_exchange_stats():
+    """
+    Recomputes the pair aggregates from the full trade history in memory and
+    compares them with the persisted incremental totals.
+
+    Returns:
+        bool: True if the incremental aggregates match a full rebuild.
+    """
+    conn = get_trades_connection()
+    cursor = conn.cursor()
+    cursor.execute("""
+        SELECT offered_quantity, offered_ticket_type, requested_quantity, requested_ticket_type
+        FROM ticket_trades
+        WHERE offered_quantity > 0 AND requested_quantity > 0
+          AND offered_ticket_type IS NOT NULL AND offered_ticket_type != ''
+          AND requested_ticket_type IS NOT NULL AND requested_ticket_type != ''
+    """)
+    rebuilt = _aggregate_trades(cursor.fetchall(), _new_pair_stats())
+
+    update_pair_exchange_stats()
+    return dict(rebuilt) == dict(load_pair_exchange_stats())
+
+
+def _canonicalize_ratio_types(cursor):
+    """
+    Renames known ticket types in both ratio tables to their canonical registry
+    name, as tradestorer's migration 5 does for the trades, so tables saved
+    under the old uppercased names ("T-BAR") keep answering lookups before
+    ratios are recalculated. Returns the number of rows renamed.
+    """
+    renamed = 0
+    for table in ("ticket_trades_ratios", "ticket_value_matrix"):
+        for column in ("type_a", "type_b"):
+            cursor.execute(f"SELECT DISTINCT {column} FROM {table}")
+            for (name,) in cursor.fetchall():
+                canonical = tickettypes.normalize(name)
+                if canonical is not None and canonical != name:
+                    # The old names were all uppercased, so two of them never map to the same canonical name
+                    cursor.execute(f"UPDATE OR REPLACE {table} SET {column} = ? WHERE {column} = ?", (canonical, name))
+                    renamed += cursor.rowcount
+    return renamed
 
 def create_relative_values_table():
-    conn = sqlite3.connect(RATIO_DATABASE_NAME)
+    """
+    Creates the ratio tables, or brings existing ones up to date: ticket types
+    are stored under their canonical names, and a snapshot of renamed tables
+    is republished right away.
+    """
+    conn = get_connection(RATIO_DATABASE_NAME)
     cursor = conn.cursor()
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS ticket_trades_ratios (
@@ -165,8 +480,50 @@ def create_relative_values_table():
             PRIMARY KEY (type_a, type_b)
         )
     ''')
+    # Dense all-pairs version of the ratios, including pairs that never traded directly
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS ticket_value_matrix (
+            type_a TEXT,
+            type_b TEXT,
+            ratio REAL,
+            trade_count INTEGER,
+            source TEXT,
+            PRIMARY KEY (type_a, type_b)
+        )
+    ''')
+    # Identifies the current contents of both tables: a random token per database
+    # file and a counter bumped by every row written or deleted, by any code path.
+    # ratiosnapshot stamps it into each snapshot so readers can tell a stale one.
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS ratio_generation (
+            id INTEGER PRIMARY KEY CHECK (id = 0),
+            token TEXT NOT NULL,
+            generation INTEGER NOT NULL
+        )
+    ''')
+    cursor.execute("INSERT OR IGNORE INTO ratio_generation (id, token, generation) VALUES (0, lower(hex(randomblob(8))), 0)")
+    for table in ("ticket_trades_ratios", "ticket_value_matrix"):
+        for operation in ("INSERT", "UPDATE", "DELETE"):
+            cursor.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS trg_{table}_{operation.lower()}_generation
+                AFTER {operation} ON {table}
+                BEGIN
+                    UPDATE ratio_generation SET generation = generation + 1 WHERE id = 0;
+                END
+            ''')
     conn.commit()
-    conn.close()
+
+    try:
+        cursor.execute("BEGIN IMMEDIATE") # One process renames, the others then find nothing left to do
+        renamed = _canonicalize_ratio_types(cursor)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    if renamed:
+        print(f"Renamed {renamed} ratio rows to canonical ticket type names")
+        # The renames bumped the generation, so the old snapshot is already ignored; replace it
+        ratiosnapshot.publish(RATIO_DATABASE_NAME)
 
 
 def save_relative_values(relative_values):
@@ -174,7 +531,7 @@ def save_relative_values(relative_values):
         print("No relative values provided to save.")
         return
     try:
-        conn = sqlite3.connect(RATIO_DATABASE_NAME)
+        conn = get_connection(RATIO_DATABASE_NAME)
         cursor = conn.cursor()
 
         # Prepare data for executemany
@@ -205,6 +562,11 @@ def save_relative_values(relative_values):
                 timestamp = CURRENT_TIMESTAMP
         '''
         cursor.executemany(sql_upsert, data_to_upsert)
+        # relative_values covers every traded pair, so any other row is left over
+        # from a pair that no longer exists (e.g. an old spelling of a ticket type)
+        cursor.execute("SELECT type_a, type_b FROM ticket_trades_ratios")
+        stale_pairs = [pair for pair in cursor.fetchall() if pair not in relative_values]
+        cursor.executemany("DELETE FROM ticket_trades_ratios WHERE type_a = ? AND type_b = ?", stale_pairs)
         conn.commit()
         print(f"Successfully saved/updated {len(data_to_upsert)} ratio entries.")
 
@@ -216,21 +578,155 @@ def save_relative_values(relative_values):
         print(f"An unexpected error occurred: {e}")
         if conn:
             conn.rollback()
-    finally:
-        if conn:
-            conn.close()
+
+# --- All-Pairs Value Matrix ---
+MATRIX_FIT_TOLERANCE = 1e-12
+MATRIX_FIT_MAX_ITERATIONS = 10000
+
+def _fit_log_values(relative_values):
+    """
+    Fits one log-value per ticket type so that log(v_a) - log(v_b) matches
+    log(average_ratio) of every directly traded pair, weighted by trade_count
+    (weighted least squares, solved with Gauss-Seidel). Each connected group
+    of types is anchored at its alphabetically first type.
+
+    Returns:
+        dict: {ticket_type: (component_id, log_value)}
+    """
+    neighbours = defaultdict(list)
+    for (type_a, type_b), stats in relative_values.items():
+        ratio = stats.get('average_ratio')
+        if type_a >= type_b or not ratio or ratio <= 0:
+            continue # The inverse direction carries the same information
+        log_ratio = math.log(ratio) # average_ratio = B per A = v_a / v_b
+        weight = max(stats.get('trade_count') or 0, 1)
+        neighbours[type_a].append((type_b, log_ratio, weight))
+        neighbours[type_b].append((type_a, -log_ratio, weight))
+
+    # Breadth-first walk: find components and seed each type with a path-derived value
+    log_values = {}
+    component = {}
+    for anchor in sorted(neighbours):
+        if anchor in component:
+            continue
+        component[anchor] = anchor
+        log_values[anchor] = 0.0
+        queue = [anchor]
+        for current in queue:
+            for other, log_ratio, weight in neighbours[current]:
+                if other not in component:
+                    component[other] = anchor
+                    log_values[other] = log_values[current] - log_ratio
+                    queue.append(other)
+
+    # Gauss-Seidel on the weighted normal equations, anchors stay fixed at 0
+    free_types = [ticket_type for ticket_type in sorted(neighbours) if component[ticket_type] != ticket_type]
+    for _ in range(MATRIX_FIT_MAX_ITERATIONS):
+        largest_change = 0.0
+        for ticket_type in free_types:
+            total_weight = 0.0
+            weighted_sum = 0.0
+            for other, log_ratio, weight in neighbours[ticket_type]:
+                total_weight += weight
+                weighted_sum += weight * (log_values[other] + log_ratio)
+            new_value = weighted_sum / total_weight
+            largest_change = max(largest_change, abs(new_value - log_values[ticket_type]))
+            log_values[ticket_type] = new_value
+        if largest_change < MATRIX_FIT_TOLERANCE:
+            break
+
+    return {ticket_type: (component[ticket_type], log_values[ticket_type]) for ticket_type in neighbours}
+
+def calculate_value_matrix(relative_values):
+    """
+    Builds a ratio for every ordered pair of ticket types. Directly traded
+    pairs keep their own ratio (rounded like ticket_trades_ratios, so verdicts
+    for them don't change); other pairs are derived from the fitted per-type
+    values, i.e. through multi-hop trade paths. Types that are not connected
+    by any chain of trades get no entry.
+
+    Returns:
+        dict: {(type_a, type_b): {'ratio', 'trade_count', 'source'}} where
+              source is 'direct' or 'derived'.
+    """
+    if not relative_values:
+        return {}
+    fitted = _fit_log_values(relative_values)
+
+    value_matrix = {}
+    for type_a, type_b in itertools.permutations(sorted(fitted), 2):
+        component_a, log_a = fitted[type_a]
+        component_b, log_b = fitted[type_b]
+        direct = relative_values.get((type_a, type_b))
+        if direct and direct.get('average_ratio'):
+            value_matrix[(type_a, type_b)] = {
+                'ratio': round(direct['average_ratio'], 1),
+                'trade_count': direct.get('trade_count') or 0,
+                'source': 'direct'
+            }
+        elif component_a == component_b:
+            value_matrix[(type_a, type_b)] = {
+                'ratio': round(math.exp(log_a - log_b), 3),
+                'trade_count': 0,
+                'source': 'derived'
+            }
+    return value_matrix
+
+def _replace_value_matrix(cursor, value_matrix):
+    cursor.execute("DELETE FROM ticket_value_matrix")
+    cursor.executemany('''
+        INSERT INTO ticket_value_matrix (type_a, type_b, ratio, trade_count, source)
+        VALUES (?, ?, ?, ?, ?)
+    ''', [(type_a, type_b, stats['ratio'], stats['trade_count'], stats['source'])
+          for (type_a, type_b), stats in value_matrix.items()])
+
+def save_value_matrix(value_matrix):
+    """Replaces the stored ticket_value_matrix with value_matrix in one transaction."""
+    conn = get_connection(RATIO_DATABASE_NAME)
+    try:
+        cursor = conn.cursor()
+        _replace_value_matrix(cursor, value_matrix)
+        conn.commit()
+        print(f"Successfully saved {len(value_matrix)} value matrix entries.")
+    except sqlite3.Error as e:
+        print(f"Database error while saving value matrix: {e}")
+        conn.rollback()
+
+def refresh_ratios(full_rebuild=False, engine=DEFAULT_ENGINE):
+    """
+    Recomputes and stores the ratio table and the all-pairs value matrix,
+    then publishes them as a ratiosnapshot file for the API workers.
+    """
+    create_relative_values_table()
+    with metrics.timer("ratio_stage_seconds", stage="calculate_relative_values"):
+        relative_values = calculate_relative_values(full_rebuild=full_rebuild, engine=engine)
+    if relative_values is None:
+        return None
+    with metrics.timer("ratio_stage_seconds", stage="save_relative_values"):
+        save_relative_values(relative_values)
+    with metrics.timer("ratio_stage_seconds", stage="calculate_value_matrix"):
+        value_matrix = calculate_value_matrix(relative_values)
+    with metrics.timer("ratio_stage_seconds", stage="save_value_matrix"):
+        save_value_matrix(value_matrix)
+    with metrics.timer("ratio_stage_seconds", stage="publish_snapshot"):
+        ratiosnapshot.publish(RATIO_DATABASE_NAME)
+    return relative_values
 
 def remove_entry(type_a, type_b):
     """
-    Removes a specific entry from the ticket_trades_ratios table based on type_a and type_b.
+    Removes a specific entry from the ticket_trades_ratios table based on type_a and type_b,
+    and rebuilds the value matrix from the remaining entries in the same transaction.
 
     Args:
         type_a (str): The req type of the entry to remove.
         type_b (str): The off type of the entry to remove.
     """
+    type_a = tickettypes.normalize(type_a) or type_a
+    type_b = tickettypes.normalize(type_b) or type_b
     conn = None
     try:
-        conn = sqlite3.connect(RATIO_DATABASE_NAME)
+        create_relative_values_table()
+        conn = get_connection(RATIO_DATABASE_NAME)
         cursor = conn.cursor()
 
         # SQL statement to delete the entry
@@ -239,10 +735,19 @@ def remove_entry(type_a, type_b):
             WHERE type_a = ? AND type_b = ?
         '''
         cursor.execute(sql_delete, (type_a, type_b))
+        removed = cursor.rowcount
+        if removed > 0:
+            # The matrix still holds the removed pair as 'direct', and derived
+            # ratios may have been fitted through it
+            cursor.execute("SELECT type_a, type_b, average_ratio, trade_count FROM ticket_trades_ratios")
+            relative_values = {(row_a, row_b): {'average_ratio': average_ratio, 'trade_count': trade_count}
+                               for row_a, row_b, average_ratio, trade_count in cursor.fetchall()}
+            _replace_value_matrix(cursor, calculate_value_matrix(relative_values))
         conn.commit()
 
-        if cursor.rowcount > 0:
+        if removed > 0:
             print(f"Successfully removed entry: (type_a={type_a}, type_b={type_b})")
+            ratiosnapshot.publish(RATIO_DATABASE_NAME)
         else:
             print(f"No entry found with type_a='{type_a}' and type_b='{type_b}'.")
 
@@ -254,20 +759,18 @@ def remove_entry(type_a, type_b):
         print(f"An unexpected error occurred: {e}")
         if conn:
             conn.rollback()
-    finally:
-        if conn:
-            conn.close()
 
 def viewdb():
-    conn = sqlite3.connect(RATIO_DATABASE_NAME)
+    conn = get_connection(RATIO_DATABASE_NAME)
     cursor = conn.cursor()
     cursor.execute("SELECT * FROM ticket_trades_ratios")
     rows = cursor.fetchall()
     for row in rows:
         print(row)
-    conn.close()
 
 if __name__ == "__main__":
-    create_relative_values_table()
-    save_relative_values(calculate_relative_values())
+    # Pass --full-rebuild to recompute the pair aggregates from the whole trade history,
+    # and --engine=numpy to aggregate with the vectorized engine
+    engine = next((arg.split("=", 1)[1] for arg in sys.argv if arg.startswith("--engine=")), DEFAULT_ENGINE)
+    refresh_ratios(full_rebuild="--full-rebuild" in sys.argv, engine=engine)
     viewdb()
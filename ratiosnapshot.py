@@ -0,0 +1,295 @@
+#DELAD BINÄR ÖGONBLICKSBILD AV RATIOSARNA FÖR API-PROCESSERNA
+
+import math
+import mmap
+import os
+import sqlite3
+import struct
+import sys
+import threading
+import time
+from array import array
+from collections.abc import Mapping
+from database import get_connection
+import metrics
+
+RATIO_DATABASE_NAME = "ticket_trades_ratios.db"
+SNAPSHOT_NAME = "ticket_trades_ratios.snapshot"
+
+# --- File Layout ---
+# ratiocalc publishes the all-time ratio table and value matrix as one
+# immutable file after every refresh. Readers map it read-only, so every API
+# worker shares the same page cache copy and looks pairs up straight in the
+# mapped arrays. The file is always replaced as a whole (write + rename),
+# never modified in place. All values are in native byte order.
+#
+#   header         SNAPSHOT_HEADER, see below. Carries the ratio database's
+#                  ratio_generation (token, generation) the tables were read at,
+#                  see read_generation()
+#   type names     names_size bytes of UTF-8 names separated by NUL, padded to 8 bytes
+#   ratio          float64[n*n]  value matrix ratio (B per A) at [a * n + b]
+#   count          int64[n*n]    value matrix trade_count
+#   direct ratio   float64[n*n]  ratio table average_ratio (NaN when NULL)
+#   direct count   int64[n*n]    ratio table trade_count, -1 where the pair has no row
+#   source         uint8[n*n]    value matrix source, 0 where the pair has no entry
+#
+# Types are sorted by name, like fetch_value_matrix()['types'], and a pair's
+# arrays are indexed by the two types' positions in that list.
+SNAPSHOT_MAGIC = b"TTRATIO\0"
+SNAPSHOT_FORMAT_VERSION = 3
+SNAPSHOT_HEADER = struct.Struct("<8sBBHIIdq16s4x") # magic, format version, big endian flag, reserved, n, names_size, created,
+                                                  # generation, generation token
+SOURCES = (None, "direct", "derived") # Stored as their index
+NO_DIRECT_ROW = -1
+
+def _pad(size):
+    return -size % 8
+
+# --- Writing ---
+def read_generation(conn):
+    """
+    Returns the ratio database's (token, generation), which changes with every
+    write to its ratio tables, or None if the database predates ratio_generation.
+    """
+    try:
+        row = conn.execute("SELECT token, generation FROM ratio_generation WHERE id = 0").fetchone()
+    except sqlite3.OperationalError:
+        return None # Table not created yet
+    return tuple(row) if row is not None else None
+
+def read_ratio_tables(db_name=RATIO_DATABASE_NAME):
+    """
+    Reads the stored ratio table and value matrix in the shape interact serves
+    them, plus the generation they were read at: ({(type_a, type_b): {'average_ratio', 'trade_count'}},
+    {(type_a, type_b): {'ratio', 'trade_count', 'source'}}, (token, generation) or None).
+    Like interact, a missing or empty value matrix falls back to the direct pairs.
+    """
+    conn = get_connection(db_name)
+    # Read before the tables: a save landing in between leaves the snapshot
+    # looking older than the database (ignored), never newer
+    generation = read_generation(conn)
+    cursor = conn.cursor()
+    cursor.execute("SELECT type_a, type_b, average_ratio, trade_count FROM ticket_trades_ratios")
+    relative_values = {(type_a, type_b): {'average_ratio': average_ratio, 'trade_count': trade_count}
+                       for type_a, type_b, average_ratio, trade_count in cursor.fetchall()}
+    try:
+        cursor.execute("SELECT type_a, type_b, ratio, trade_count, source FROM ticket_value_matrix")
+        rows = cursor.fetchall()
+    except sqlite3.OperationalError:
+        rows = [] # Table not created yet
+    pairs = {(type_a, type_b): {'ratio': ratio, 'trade_count': trade_count, 'source': source}
+             for type_a, type_b, ratio, trade_count, source in rows}
+    if not pairs:
+        pairs = {pair: {'ratio': stats['average_ratio'], 'trade_count': stats['trade_count'], 'source': 'direct'}
+                 for pair, stats in relative_values.items() if stats['average_ratio'] is not None}
+    return relative_values, pairs, generation
+
+def write_snapshot(relative_values, pairs, generation=None, path=SNAPSHOT_NAME):
+    """
+    Writes relative_values, the value matrix pairs and their generation (as
+    returned by read_ratio_tables) to path. The file is written next to its final name
+    and renamed over it, so readers only ever see complete snapshots.
+
+    Returns:
+        int: Number of ticket types in the snapshot.
+    """
+    types = sorted({ticket_type for pair in (*relative_values, *pairs) for ticket_type in pair})
+    index = {ticket_type: position for position, ticket_type in enumerate(types)}
+    n = len(types)
+
+    ratios = array('d', [float('nan')]) * (n * n)
+    counts = array('q', [0]) * (n * n)
+    sources = array('B', [0]) * (n * n)
+    for (type_a, type_b), stats in pairs.items():
+        offset = index[type_a] * n + index[type_b]
+        ratios[offset] = stats['ratio']
+        counts[offset] = stats['trade_count'] or 0
+        sources[offset] = SOURCES.index(stats['source'])
+    direct_ratios = array('d', [float('nan')]) * (n * n)
+    direct_counts = array('q', [NO_DIRECT_ROW]) * (n * n)
+    for (type_a, type_b), stats in relative_values.items():
+        offset = index[type_a] * n + index[type_b]
+        if stats['average_ratio'] is not None:
+            direct_ratios[offset] = stats['average_ratio']
+        direct_counts[offset] = stats['trade_count'] or 0
+
+    names = b"\0".join(ticket_type.encode('utf-8') for ticket_type in types)
+    token, generation_count = generation or ("", -1) # -1: never matches a database
+    header = SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_FORMAT_VERSION, sys.byteorder == "big", 0,
+                                  n, len(names), time.time(), generation_count, token.encode('ascii'))
+
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with open(temp_path, 'wb') as f:
+        f.write(header)
+        f.write(names + b"\0" * _pad(len(names)))
+        for values in (ratios, counts, direct_ratios, direct_counts, sources):
+            f.write(values.tobytes())
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, path)
+    return n
+
+def publish(db_name=RATIO_DATABASE_NAME, path=SNAPSHOT_NAME):
+    """
+    Writes a new snapshot of the ratio tables currently stored in db_name.
+    Called by ratiocalc.refresh_ratios and remove_entry. Until a change made
+    any other way is published, readers see the snapshot's generation differ
+    from the database's and read SQLite instead.
+    """
+    try:
+        relative_values, pairs, generation = read_ratio_tables(db_name)
+        type_count = write_snapshot(relative_values, pairs, generation, path)
+        print(f"Published ratio snapshot with {type_count} ticket types to {path}")
+    except (sqlite3.Error, OSError) as e:
+        print(f"Error publishing ratio snapshot: {e}")
+
+# --- Reading ---
+class SnapshotPairs(Mapping):
+    """
+    Read-only {(type_a, type_b): stats} view over the mapped snapshot arrays,
+    answering like the dicts interact builds from SQLite. Nothing is copied out
+    of the mapping up front; a pair's stats dict is built on first access and
+    then kept, so hot pairs cost one dict lookup like the SQLite-backed cache.
+    """
+
+    def __init__(self, snapshot, ratios, counts, present, ratio_field, source=None):
+        self._index = snapshot.index
+        self._types = snapshot.types
+        self._n = len(snapshot.types)
+        self._ratios = ratios
+        self._counts = counts
+        self._present = present # offset -> bool
+        self._ratio_field = ratio_field
+        self._source = source
+        self._built = {} # key -> stats dict handed out before
+        self._len = sum(1 for offset in range(self._n * self._n) if present(offset))
+
+    def _offset(self, key):
+        try:
+            type_a, type_b = key
+            offset = self._index[type_a] * self._n + self._index[type_b]
+        except (KeyError, TypeError, ValueError):
+            return None
+        return offset if self._present(offset) else None
+
+    def __getitem__(self, key):
+        try:
+            return self._built[key]
+        except (KeyError, TypeError):
+            pass
+        offset = self._offset(key)
+        if offset is None:
+            raise KeyError(key)
+        ratio = self._ratios[offset]
+        stats = {self._ratio_field: None if math.isnan(ratio) else ratio, 'trade_count': self._counts[offset]}
+        if self._source is not None:
+            stats['source'] = SOURCES[self._source[offset]]
+        self._built[key] = stats
+        return stats
+
+    def __contains__(self, key):
+        try:
+            if key in self._built:
+                return True
+        except TypeError:
+            return False
+        return self._offset(key) is not None
+
+    def __iter__(self):
+        n = self._n
+        for offset in range(n * n):
+            if self._present(offset):
+                yield self._types[offset // n], self._types[offset % n]
+
+    def __len__(self):
+        return self._len
+
+
+class RatioSnapshot:
+    """
+    One published snapshot, mapped read-only. relative_values and
+    value_matrix have the same shape as interact's fetch_relative_values()
+    and fetch_value_matrix() results.
+    """
+
+    def __init__(self, path=SNAPSHOT_NAME):
+        self.path = path
+        with open(path, 'rb') as f:
+            self.stat_key = _stat_key(os.fstat(f.fileno()))
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(self._mmap)
+        if len(view) < SNAPSHOT_HEADER.size:
+            raise ValueError("file is too short")
+        magic, version, big_endian, _, n, names_size, self.created, generation, token = SNAPSHOT_HEADER.unpack_from(view)
+        self.generation = (token.rstrip(b"\0").decode('ascii'), generation) # Compare with read_generation()
+        if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_FORMAT_VERSION:
+            raise ValueError("not a ratio snapshot of this format version")
+        if bool(big_endian) != (sys.byteorder == "big"):
+            raise ValueError("written on a machine with another byte order")
+
+        offset = SNAPSHOT_HEADER.size
+        def take(format, count, itemsize):
+            nonlocal offset
+            section = view[offset:offset + count * itemsize]
+            if len(section) != count * itemsize:
+                raise ValueError("file is truncated")
+            offset += count * itemsize
+            return section.cast(format)
+
+        names = bytes(view[offset:offset + names_size])
+        offset += names_size + _pad(names_size)
+        self.types = [sys.intern(name) for name in names.decode('utf-8').split("\0")] if n else []
+        if len(self.types) != n:
+            raise ValueError("type table doesn't match the type count")
+        self.index = {ticket_type: position for position, ticket_type in enumerate(self.types)}
+
+        ratios = take('d', n * n, 8)
+        counts = take('q', n * n, 8)
+        direct_ratios = take('d', n * n, 8)
+        direct_counts = take('q', n * n, 8)
+        sources = take('B', n * n, 1)
+
+        self.relative_values = SnapshotPairs(self, direct_ratios, direct_counts,
+                                             lambda offset: direct_counts[offset] != NO_DIRECT_ROW, 'average_ratio')
+        pairs = SnapshotPairs(self, ratios, counts, sources.__getitem__, 'ratio', sources)
+        matrix_types = sorted({ticket_type for pair in pairs for ticket_type in pair})
+        self.value_matrix = {'types': matrix_types, 'pairs': pairs}
+
+def _stat_key(stat):
+    return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+_current = None
+_rejected = None # (path, stat key) of a file that failed to load, so it is reported once
+_lock = threading.Lock()
+
+def current(path=SNAPSHOT_NAME):
+    """
+    Returns the newest published snapshot at path, or None if there is none.
+
+    Costs one stat() per call. When the file has been replaced since the last
+    call, the new one is mapped and swapped in; callers still holding the old
+    snapshot keep a valid mapping until they drop it.
+    """
+    global _current, _rejected
+    try:
+        key = _stat_key(os.stat(path))
+    except OSError:
+        return None
+    snapshot = _current
+    if snapshot is not None and snapshot.path == path and snapshot.stat_key == key:
+        return snapshot
+    if _rejected == (path, key):
+        return None
+
+    with _lock:
+        snapshot = _current
+        if snapshot is None or snapshot.path != path or snapshot.stat_key != key:
+            try:
+                with metrics.timer("ratio_cache_load_seconds", table="snapshot"):
+                    snapshot = RatioSnapshot(path)
+            except (OSError, ValueError) as e:
+                print(f"Ignoring ratio snapshot {path}: {e}")
+                _rejected = (path, key)
+                return None
+            _current = snapshot
+    return snapshot
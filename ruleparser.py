@@ -0,0 +1,117 @@
+#TOLKAR VANLIGA TRADES LOKALT UTAN GEMINI
+
+import re
+from tickettypes import TICKET_ALIASES
+
+NUMBER_WORDS = {
+    "en": 1, "ett": 1, "två": 2, "tre": 3, "fyra": 4, "fem": 5,
+    "sex": 6, "sju": 7, "åtta": 8, "nio": 9, "tio": 10,
+}
+
+# Words splitting a message into the offered part (left) and the requested part (right),
+# with the confidence each one carries. "mot" is by far the most common and least ambiguous.
+SEPARATORS = {"mot": 1.0, "till": 0.9, "för": 0.9, "söker": 0.9}
+
+# Phrases that usually mean the message is a request first ("Söker X, har Y"),
+# which flips the direction and is left to Gemini.
+REVERSED_MARKERS = ("söker", "letar", "vill ha", "köper")
+
+MAX_QUANTITY = 20 # Anything larger is more likely a date or a price than a ticket count
+MISSING_QUANTITY_PENALTY = 0.05 # Quantity defaults to 1, as in the prompt examples (never on both sides)
+
+# Longest alias first so "skvalborg" wins over "kvalborg" and "ögs" over "ög"
+_ALIAS_PATTERN = re.compile(
+    r"(?<!\w)(" + "|".join(re.escape(alias) for alias in sorted(TICKET_ALIASES, key=len, reverse=True)) + r")(?!\w)"
+)
+_NUMBER_PATTERN = re.compile(r"(?<!\w)(\d+|" + "|".join(NUMBER_WORDS) + r")(?!\w)")
+_DIGIT_TOKEN_PATTERN = re.compile(r"\w*\d\w*") # "2", but also "2st", "100kr", "18e"
+_SEPARATOR_PATTERN = re.compile(r"(?<!\w)(" + "|".join(SEPARATORS) + r")(?!\w)")
+
+
+def _parse_side(text):
+    """
+    Finds the single ticket type and quantity in one side of a message.
+
+    Returns:
+        tuple: (quantity, ticket_type), with quantity None when the side gives
+               none, or None if the side mentions no ticket type, several
+               types, several quantities, or digits that aren't a plain
+               number ("2st", "100kr", which could be a count or a price).
+    """
+    ticket_types = {TICKET_ALIASES[match.group(1)] for match in _ALIAS_PATTERN.finditer(text)}
+    if len(ticket_types) != 1:
+        return None
+
+    # Aliases such as "1 maj" contain numbers, so strip them before counting quantities
+    remaining = _ALIAS_PATTERN.sub(" ", text)
+    if any(not token.isdigit() for token in _DIGIT_TOKEN_PATTERN.findall(remaining)):
+        return None
+    quantities = []
+    for match in _NUMBER_PATTERN.finditer(remaining):
+        word = match.group(1)
+        quantities.append(int(word) if word.isdigit() else NUMBER_WORDS[word])
+
+    if len(quantities) > 1:
+        return None
+    if not quantities:
+        return None, ticket_types.pop()
+    if not 0 < quantities[0] <= MAX_QUANTITY:
+        return None
+    return quantities[0], ticket_types.pop()
+
+
+def parse_trade_text(text):
+    """
+    Parses a trade message such as "Byter två NSA mot två ÖG" without calling Gemini.
+
+    Returns:
+        tuple: ((offered_quantity, offered_ticket_type, requested_quantity, requested_ticket_type), confidence).
+               The trade is None and confidence 0.0 when the message doesn't match
+               the simple "<offer> mot <request>" shape.
+    """
+    lowered = text.lower()
+
+    # Pick the strongest separator present, earliest occurrence on ties
+    separator = None
+    for match in _SEPARATOR_PATTERN.finditer(lowered):
+        if separator is None or SEPARATORS[match.group(1)] > SEPARATORS[separator.group(1)]:
+            separator = match
+    if separator is None:
+        return None, 0.0
+
+    offered_text = lowered[:separator.start()]
+    requested_text = lowered[separator.end():]
+    if any(marker in offered_text for marker in REVERSED_MARKERS):
+        return None, 0.0
+
+    offered = _parse_side(offered_text)
+    requested = _parse_side(requested_text)
+    if offered is None or requested is None or offered[1] == requested[1]:
+        return None, 0.0
+
+    offered_quantity, offered_ticket_type = offered
+    requested_quantity, requested_ticket_type = requested
+    if offered_quantity is None and requested_quantity is None:
+        return None, 0.0 # Nothing to anchor a 1-for-1 guess on, leave it to Gemini
+
+    confidence = SEPARATORS[separator.group(1)]
+    if offered_quantity is None or requested_quantity is None:
+        confidence *= 1.0 - MISSING_QUANTITY_PENALTY
+        offered_quantity = offered_quantity or 1
+        requested_quantity = requested_quantity or 1
+    return (offered_quantity, offered_ticket_type, requested_quantity, requested_ticket_type), round(confidence, 3)
+
+
+if __name__ == "__main__":
+    test_texts = [
+        "Byter två NSA mot två biljetter till ÖGs",
+        "Hejj!! Byter gärna en skvalborg (ssk) mot en yran",
+        "Hallojs! Byter gärna min 1a maj mot yran",
+        "Byter tre kvalborg mot tre sunwing!",
+        "Har två NSA på Lunds som jag gärna byter till två siste april på ÖG!!",
+        "Har 2 skvalborg som ja gärna byter mot 2 tbar siste april!!!",
+        "Söker HK, har MÖ",
+        "Byter 2st NSA mot 2st ÖG",
+    ]
+    for text in test_texts:
+        print(text, "->", parse_trade_text(text))
@@ -0,0 +1,18 @@
+import benchmark_ingest
+import tradereader
+from ruleparser import parse_trade_text
+
+
+def test_rule_share_messages_parse():
+    messages, answers = benchmark_ingest.synthetic_messages(2000, llm_share=0.0, repeat_share=0.0)
+    for text in messages:
+        result, confidence = parse_trade_text(text)
+        assert result == answers[text], text
+        assert confidence >= tradereader.RULE_CONFIDENCE_THRESHOLD, text
+
+
+def test_llm_share_messages_are_left_to_the_llm():
+    messages, _ = benchmark_ingest.synthetic_messages(500, llm_share=1.0, repeat_share=0.0)
+    for text in messages:
+        result, confidence = parse_trade_text(text)
+        assert result is None or confidence < tradereader.RULE_CONFIDENCE_THRESHOLD, text
@@ -0,0 +1,20 @@
+import tradestorer
+
+
+def test_malformed_row_is_skipped(tmp_path, monkeypatch):
+    monkeypatch.setattr(tradestorer, "TRADE_DATABASE_NAME", str(tmp_path / "trades.db"))
+    path = tmp_path / "trades.csv"
+    path.write_text(
+        "offered_quantity,offered_ticket_type,requested_quantity,requested_ticket_type,timestamp,dedupe_key\n"
+        "2,HK,3,GBG,,a\n"
+        "2.0,HK,3,GBG,,b\n"
+        ",HK,3,GBG,,c\n"
+        "1,T-bar,1,HK,,d\n",
+        encoding="utf-8",
+    )
+
+    assert tradestorer.import_trades_csv(str(path)) == 2
+
+    cursor = tradestorer.get_trades_connection().cursor()
+    cursor.execute("SELECT offered_quantity, offered_ticket_type, dedupe_key FROM ticket_trades ORDER BY dedupe_key")
+    assert cursor.fetchall() == [(2, "HK", "a"), (1, "T-Bar", "d")]
@@ -0,0 +1,60 @@
+#REGISTER ÖVER BILJETTYPERNA
+
+# The eight ticket types, in the short form the Gemini prompt asks for.
+TICKET_TYPES = ["GBG", "MÖ", "NSA", "SSK", "VG/H", "T-Bar", "ÖG", "HK"]
+
+# Lowercase spellings seen in the feed -> short ticket type.
+# Mirrors the alias list in tradereader's prompt.
+TICKET_ALIASES = {
+    "gbg": "GBG", "1 maj": "GBG", "1a maj": "GBG", "första maj": "GBG", "forsta maj": "GBG",
+    "mö": "MÖ", "yran": "MÖ",
+    "nsa": "NSA", "lunds": "NSA", "näst siste april": "NSA", "näst sista april": "NSA",
+    "ssk": "SSK", "skvalborg": "SSK", "sydskånska": "SSK",
+    "vg/h": "VG/H", "vg/hallands": "VG/H", "vg": "VG/H", "hallands": "VG/H", "kvalborg": "VG/H",
+    "t-bar": "T-Bar", "tbar": "T-Bar", "t bar": "T-Bar",
+    "ög": "ÖG", "ögs": "ÖG",
+    "hk": "HK", "sunwing": "HK",
+}
+
+_spellings = {} # exact or casefolded spelling -> canonical name
+
+def _add_spelling(spelling, canonical):
+    _spellings[spelling] = canonical
+    _spellings[" ".join(spelling.split()).casefold()] = canonical
+
+def register(name, aliases=()):
+    """
+    Adds a ticket type (and optional extra spellings) to the registry and
+    returns its canonical name. Registering a known type again just adds
+    the aliases.
+    """
+    canonical = normalize(name)
+    if canonical is None:
+        canonical = " ".join(name.split())
+        if not canonical:
+            raise ValueError("Ticket type name must not be empty")
+        TICKET_TYPES.append(canonical)
+        _add_spelling(canonical, canonical)
+    for alias in aliases:
+        _add_spelling(alias, canonical)
+    return canonical
+
+def normalize(name):
+    """
+    Returns the canonical short name for any known spelling of a ticket type
+    ("T-bar", "t bar", "Yran", " sunwing "), or None for an unknown type.
+
+    Every spelling resolves to the same string object from TICKET_TYPES, so
+    normalized names compare and hash as cheaply as possible.
+    """
+    if not isinstance(name, str):
+        return None
+    canonical = _spellings.get(name) # Canonical names, the common case, skip the cleanup below
+    if canonical is None:
+        canonical = _spellings.get(" ".join(name.split()).casefold())
+    return canonical
+
+for _name in TICKET_TYPES:
+    _add_spelling(_name, _name)
+for _alias, _name in TICKET_ALIASES.items():
+    _add_spelling(_alias, _name)
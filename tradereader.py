@@ -1,23 +1,40 @@
 #LÄS IN OCH FÖRSTÅ TRADES
 
-from google import genai
-from tradestorer import *
-from listgenerator import *
-from ratelimiter import * 
-from apikey import * 
-
-client = genai.Client(api_key = geminikey) 
+import argparse
+import json
+import os
+import hashlib
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Literal
+from tradestorer import add_trade_entries, viewdb
+from listgenerator import MessageStream, CHAT_EXPORT_RECORD_START
+from ratelimiter import RateLimiter
+from ruleparser import parse_trade_text
+from tickettypes import TICKET_TYPES
+from extractioncache import ExtractionCache
+from ratiocalc import refresh_ratios
+import metrics
 
 trades_file = "/Users/rasmusalpsten/Drive C/Code/Python Projects/Tickettrader"
 
 rate_limiter = RateLimiter(max_calls=13, time_window=60)
 
-def analyze_ticket_exchange(text):
-    rate_limiter.check()
-    prompt = f"""
-    Analyze the following text, which is a request to exchange tickets:
-    "{text}"
+GEMINI_MODEL = 'gemini-2.0-flash'
+
+DEFAULT_CONCURRENCY = 4 # Gemini requests in flight at once
+DEFAULT_INSERT_BATCH_SIZE = 50 # Parsed trades per bulk insert
+DEFAULT_PROMPT_BATCH_SIZE = 1 # Trade texts per Gemini request, see analyze_ticket_exchanges
+DEFAULT_POLL_INTERVAL = 2.0 # Seconds between checks for new messages in follow mode
+SPOOL_PROCESSED_DIR = "processed" # Subdirectory finished spool files are moved to
+SPOOL_IGNORED_SUFFIXES = (".checkpoint", ".tmp", ".part")
+MAX_EXTRACTION_ATTEMPTS = 2 # Gemini calls per prompt when the answer fails validation
+RULE_CONFIDENCE_THRESHOLD = 0.9 # Rule-parser results at or above this skip Gemini (set above 1 to disable)
 
+# Shared by the single and batch prompts so both describe the task identically
+EXTRACTION_INSTRUCTIONS = """
     Identify the quantity of tickets being offered and the type of ticket,
     and the quantity of tickets being requested and the type of ticket.
 
@@ -32,106 +49,446 @@ def analyze_ticket_exchange(text):
 
     For example:
     Text: "Har två NSA på Lunds som jag gärna byter till två siste april på ÖG!!"
-    Offered:
-    Quantity: 2
-    Ticket Type: NSA
-    Requested:
-    Quantity: 2
-    Ticket Type: ÖG
+    {"offered_quantity": 2, "offered_ticket_type": "NSA", "requested_quantity": 2, "requested_ticket_type": "ÖG"}
 
     Text: "Har en yran, byter mot en Sunwing"
-    Offered:
-    Quantity: 1
-    Ticket Type: MÖ
-    Requested:
-    Quantity: 1
-    Ticket Type: HK
+    {"offered_quantity": 1, "offered_ticket_type": "MÖ", "requested_quantity": 1, "requested_ticket_type": "HK"}
 
     Text: "Har en yran som jag gärna byter mot kvalborg på vg/hallands"
-    Offered:
-    Quantity: 1
-    Ticket Type: MÖ
-    Requested:
-    Quantity: 1
-    Ticket Type: VG/H
+    {"offered_quantity": 1, "offered_ticket_type": "MÖ", "requested_quantity": 1, "requested_ticket_type": "VG/H"}
 
     Text: "Byter tre skvalborg mot sunwing"
-    Offered:
-    Quantity: 3
-    Ticket Type: SSK
-    Requested:
-    Quantity: 1
-    Ticket Type: HK
+    {"offered_quantity": 3, "offered_ticket_type": "SSK", "requested_quantity": 1, "requested_ticket_type": "HK"}
 
     Text: "Hejhopp Byter en 1 maj mot en NSA"
-    Offered:
-    Quantity: 1
-    Ticket Type: GBG
-    Requested:
-    Quantity: 1
-    Ticket Type: NSA
+    {"offered_quantity": 1, "offered_ticket_type": "GBG", "requested_quantity": 1, "requested_ticket_type": "NSA"}
 
     Text: "Har 2 skvalborg som ja gärna byter mot 2 tbar siste april!!!"
-    Offered:
-    Quantity: 2
-    Ticket Type: SSK
-    Requested:
-    Quantity: 2
-    Ticket Type: T-bar
-
-    Always answer using this exact structure, and always use the short version of the ticket type, for example "GBG" and "SSK."
+    {"offered_quantity": 2, "offered_ticket_type": "SSK", "requested_quantity": 2, "requested_ticket_type": "T-Bar"}
+
+    Always use the short version of the ticket type, exactly as listed above, for example "GBG" and "SSK".
+"""
+
+# --- Lazily created objects ---
+# The Gemini client, the pydantic response models and the extraction cache are
+# created on first use rather than at import, so the module imports quickly,
+# without an API key, and without touching any database file.
+_init_lock = threading.RLock() # Re-entrant: the extraction cache needs the schema models
+
+_client = None
+
+def _get_client():
+    global _client
+    if _client is None:
+        with _init_lock:
+            if _client is None:
+                from google import genai
+                from apikey import geminikey
+                _client = genai.Client(api_key = geminikey)
+    return _client
+
+def set_client(client):
     """
+    Replaces the Gemini client. Anything with a compatible
+    models.generate_content(model=..., contents=[...], config=...) returning an object
+    with .text works, e.g. benchmark_ingest.FakeGeminiClient.
+    """
+    global _client
+    _client = client
 
-    try:
-        response = client.models.generate_content(
-            model = 'gemini-2.0-flash', 
-            contents = [prompt]
-            )
-        # print(response.text) # Debugging
-        lines = response.text.split('\n')
-        offered_quantity = 0
-        offered_ticket_type = ""
-        requested_quantity = 0
-        requested_ticket_type = ""
-
-        for index, line in enumerate(lines): #Searching for the quantity
-            if "Offered:" in line:
-                continue
-            if "Requested:" in line:
-                continue
-            if "Quantity:" in line:
-                try:
-                    quantity_value = line.split(":")[1].strip()
-                    if "Offered" in lines[index - 1]: # check the line before if its offered or requested
-                         offered_quantity = int(quantity_value) 
-                    else:
-                         requested_quantity = int(quantity_value)
-                except ValueError:
-                    pass  # Handle cases where the quantity is not a valid integer
-            elif "Ticket Type:" in line:
-                ticket_type_value = line.split(":")[1].strip()
-                if "Offered" in lines[lines.index(line)-2]: # check 2 lines before if its offered or requested
-                    offered_ticket_type = ticket_type_value
-                else:
-                    requested_ticket_type = ticket_type_value
-
-        return offered_quantity, offered_ticket_type, requested_quantity, requested_ticket_type
-    except Exception as e:
-        print(f"Error analyzing text: {e}")
-        pass
-
-def feeder(trade_offer_list):
-    for trades in trade_offer_list:
-        offered_quantity, offered_ticket_type, requested_quantity, requested_ticket_type = analyze_ticket_exchange(trades)
-        if offered_quantity is not None: # Only add to the database if analysis was successful
-            add_trade_entry(offered_quantity, offered_ticket_type, requested_quantity, requested_ticket_type)
-            print(f"Text: \"{trades}\"")
-            print(f"Offered Quantity: {offered_quantity}, Ticket Type: {offered_ticket_type}")
-            print(f"Requested Quantity: {requested_quantity}, Ticket Type: {requested_ticket_type}")
-            print('\n')
+# --- Response Schema ---
+# Gemini is asked for JSON matching these models (response_schema), and every
+# answer is validated against them again, so only the eight known ticket types
+# and positive quantities get through.
+_schema_models = None
+
+def _get_schema_models():
+    """Returns the (TradeExtraction, BatchTradeExtraction) pydantic models."""
+    global _schema_models
+    if _schema_models is None:
+        with _init_lock:
+            if _schema_models is None:
+                from pydantic import BaseModel, Field
+                TicketType = Literal[tuple(TICKET_TYPES)]
+
+                class TradeExtraction(BaseModel):
+                    offered_quantity: int = Field(ge=1)
+                    offered_ticket_type: TicketType
+                    requested_quantity: int = Field(ge=1)
+                    requested_ticket_type: TicketType
+
+                    def as_tuple(self):
+                        return self.offered_quantity, self.offered_ticket_type, self.requested_quantity, self.requested_ticket_type
+
+                class BatchTradeExtraction(TradeExtraction):
+                    item: int # Number of the text in the batch prompt
+
+                _schema_models = TradeExtraction, BatchTradeExtraction
+    return _schema_models
+
+def _generate(prompt, response_schema, validate, kind):
+    """
+    Sends prompt with a JSON response schema and returns validate(response.text).
+
+    Only output that fails validation is retried, up to MAX_EXTRACTION_ATTEMPTS
+    calls in total; an API error is reported and gives up right away.
+
+    Returns:
+        The validated value, or None if no valid answer was received.
+    """
+    config = {"response_mime_type": "application/json", "response_schema": response_schema}
+    for attempt in range(1, MAX_EXTRACTION_ATTEMPTS + 1):
+        rate_limiter.check()
+        metrics.inc("llm_calls_total", kind=kind)
+        try:
+            with metrics.timer("llm_request_seconds", kind=kind):
+                response = _get_client().models.generate_content(
+                    model = GEMINI_MODEL,
+                    contents = [prompt],
+                    config = config,
+                    )
+        except Exception as e:
+            metrics.inc("llm_failures_total", kind=kind)
+            print(f"Error calling Gemini: {e}")
+            return None
+        try:
+            return validate(response.text or "")
+        except ValueError as e: # Also covers pydantic's ValidationError and invalid JSON
+            metrics.inc("parse_failures_total", kind=kind)
+            print(f"Invalid Gemini answer (attempt {attempt}/{MAX_EXTRACTION_ATTEMPTS}): {e}")
+    return None
+
+def prompt_version():
+    """Short hash of the prompt text and response schema, part of the extraction cache namespace."""
+    TradeExtraction, _ = _get_schema_models()
+    return hashlib.sha256(
+        (EXTRACTION_INSTRUCTIONS + json.dumps(TradeExtraction.model_json_schema(), sort_keys=True)).encode('utf-8')
+    ).hexdigest()[:12]
+
+# Cached answers are only reused for the same model, prompt text and response schema
+_extraction_cache = None
+
+def get_extraction_cache():
+    global _extraction_cache
+    if _extraction_cache is None:
+        with _init_lock:
+            if _extraction_cache is None:
+                _extraction_cache = ExtractionCache(namespace=f"{GEMINI_MODEL}:{prompt_version()}")
+    return _extraction_cache
+
+def set_extraction_cache(cache):
+    """Replaces the extraction cache. With None, the next lookup opens a new one in the current directory."""
+    global _extraction_cache
+    _extraction_cache = cache
+
+_rule_parser_counts = {"hits": 0, "misses": 0}
+_rule_parser_lock = threading.Lock()
+
+def _rule_parse(text):
+    """Returns the local rule parser's trade if it is confident enough, otherwise None."""
+    result, confidence = parse_trade_text(text)
+    hit = result is not None and confidence >= RULE_CONFIDENCE_THRESHOLD
+    with _rule_parser_lock:
+        _rule_parser_counts["hits" if hit else "misses"] += 1
+    if hit:
+        metrics.inc("rule_parser_hits_total")
+        return result
+    return None
+
+def rule_parser_stats():
+    """Returns how many messages the rule parser answered (hits) or left to the cache and Gemini (misses)."""
+    with _rule_parser_lock:
+        hits, misses = _rule_parser_counts["hits"], _rule_parser_counts["misses"]
+    total = hits + misses
+    return {"hits": hits, "misses": misses, "hit_ratio": round(hits / total, 3) if total else None}
+
+def reset_rule_parser_stats():
+    with _rule_parser_lock:
+        _rule_parser_counts.update(hits=0, misses=0)
+
+def analyze_ticket_exchange(text):
+    result = _rule_parse(text)
+    if result is not None:
+        return result
+    result = get_extraction_cache().get(text)
+    if result is not None:
+        return result
+    return _extract_with_llm(text)
+
+def _extract_with_llm(text):
+    """Asks Gemini about one text the rule parser and cache already missed, and caches the answer."""
+    prompt = f"""
+    Analyze the following text, which is a request to exchange tickets:
+    "{text}"
+{EXTRACTION_INSTRUCTIONS}"""
+
+    TradeExtraction, _ = _get_schema_models()
+    extraction = _generate(prompt, TradeExtraction, TradeExtraction.model_validate_json, "single")
+    if extraction is None:
+        return None
+    result = extraction.as_tuple()
+    get_extraction_cache().put(text, result)
+    return result
+
+def analyze_ticket_exchanges(texts):
+    """
+    Analyzes several trade texts with a single Gemini request.
+
+    The texts are numbered in one prompt and the model answers with a JSON
+    array holding one object per text, tagged with its item number. Any item
+    that is missing from the answer or fails validation is retried on its own.
+    Texts the local rule parser handles confidently, or that are already in
+    the extraction cache, never reach Gemini.
+
+    Args:
+        texts (list): Trade texts to analyze.
+
+    Returns:
+        list: One result per input text, in input order. Each result is the
+              same tuple analyze_ticket_exchange returns, or None on failure.
+    """
+    texts = list(texts)
+    results = []
+    for text in texts:
+        result = _rule_parse(text)
+        if result is None:
+            result = get_extraction_cache().get(text)
+        results.append(result)
+    if sum(result is None for result in results) <= 1:
+        return [result if result is not None else _extract_with_llm(text)
+                for text, result in zip(texts, results)]
+
+    # Only the texts neither the rule parser nor the cache could answer go to Gemini
+    unparsed = [index for index, result in enumerate(results) if result is None]
+    for index, result in zip(unparsed, _analyze_batch([texts[index] for index in unparsed])):
+        results[index] = result
+    return results
+
+def _analyze_batch(texts):
+    """Sends texts as one numbered Gemini prompt; see analyze_ticket_exchanges."""
+    numbered_texts = "\n".join(f'    Item {number}: "{text}"' for number, text in enumerate(texts, start=1))
+    prompt = f"""
+    Analyze each of the following {len(texts)} numbered texts. Each one is a separate request to exchange tickets:
+{numbered_texts}
+{EXTRACTION_INSTRUCTIONS}
+    Answer with a JSON array holding one object per text, in order, each with
+    an "item" field set to the number of the text it answers.
+    """
+
+    def validate(answer):
+        # Only the array itself must be valid here, bad items are retried one by one below
+        items = json.loads(answer)
+        if not isinstance(items, list):
+            raise ValueError("expected a JSON array")
+        return items
+
+    _, BatchTradeExtraction = _get_schema_models()
+    parsed = {}
+    for item in _generate(prompt, list[BatchTradeExtraction], validate, "batch") or []:
+        try:
+            extraction = BatchTradeExtraction.model_validate(item)
+        except ValueError: # pydantic's ValidationError
+            continue
+        if 1 <= extraction.item <= len(texts) and extraction.item not in parsed:
+            parsed[extraction.item] = extraction.as_tuple()
+            get_extraction_cache().put(texts[extraction.item - 1], parsed[extraction.item])
+    metrics.inc("parse_failures_total", len(texts) - len(parsed), kind="batch")
+
+    results = []
+    for number, text in enumerate(texts, start=1):
+        if number in parsed:
+            results.append(parsed[number])
         else:
-            print(f"Failed to analyze text: \"{trades}\"")
-            print('\n')
+            # Fall back to a single-item request for anything the batch answer didn't cover
+            results.append(_extract_with_llm(text))
+    return results
+
+def _ingest_metrics():
+    # Scrapes shouldn't open the cache database before any message needed it
+    cache_stats = _extraction_cache.stats() if _extraction_cache is not None else {"hits": 0, "misses": 0}
+    limiter_stats = rate_limiter.stats()
+    return [
+        ("extraction_cache_hits_total", "counter", {}, cache_stats["hits"]),
+        ("extraction_cache_misses_total", "counter", {}, cache_stats["misses"]),
+        ("rate_limiter_calls_total", "counter", {}, limiter_stats["total_calls"]),
+        ("rate_limiter_throttled_total", "counter", {}, limiter_stats["throttled_calls"]),
+        ("rate_limiter_tokens", "gauge", {}, limiter_stats["current_tokens"]),
+    ]
+
+metrics.register_collector(_ingest_metrics)
+
+def _report(trades, result):
+    if result is not None:
+        offered_quantity, offered_ticket_type, requested_quantity, requested_ticket_type = result
+        print(f"Text: \"{trades}\"")
+        print(f"Offered Quantity: {offered_quantity}, Ticket Type: {offered_ticket_type}")
+        print(f"Requested Quantity: {requested_quantity}, Ticket Type: {requested_ticket_type}")
+        print('\n')
+    else:
+        print(f"Failed to analyze text: \"{trades}\"")
+        print('\n')
+
+def feeder(trade_offer_list, concurrency=DEFAULT_CONCURRENCY, insert_batch_size=DEFAULT_INSERT_BATCH_SIZE,
+           prompt_batch_size=DEFAULT_PROMPT_BATCH_SIZE, on_flush=None):
+    """
+    Runs every text through Gemini and stores the results.
+
+    Up to `concurrency` Gemini requests are kept in flight at once; the shared
+    rate_limiter still decides when each one may start, so the quota is used
+    fully without idle gaps between serial calls. With prompt_batch_size > 1,
+    each request carries that many texts (see analyze_ticket_exchanges).
+    Parsed trades are written with one bulk insert per `insert_batch_size` rows.
+
+    Texts are handled in input order, so after every insert all texts
+    consumed so far are done. on_flush(count) is then called with that count,
+    which lets a MessageStream checkpoint how far the input has been stored.
+
+    Args:
+        trade_offer_list (iterable): Trade texts, consumed lazily.
+        concurrency (int): Number of worker threads calling Gemini.
+        insert_batch_size (int): Rows per database transaction.
+        prompt_batch_size (int): Trade texts packed into each Gemini request.
+        on_flush (callable): Called with the number of input texts fully processed after each insert.
+
+    Returns:
+        int: Number of trades stored.
+    """
+    stored = 0
+    processed = 0 # Input texts whose results are in the database (or were unparseable)
+    batch = []
+    pending = deque()
+    # Enough queued work that a worker is always ready when the limiter frees a slot
+    max_pending = max(1, concurrency) * 2
+
+    def flush():
+        nonlocal stored
+        if batch:
+            stored += add_trade_entries(batch)
+            batch.clear()
+        if on_flush is not None:
+            on_flush(processed)
+
+    def drain_one():
+        nonlocal processed
+        texts, future = pending.popleft()
+        for trades, result in zip(texts, future.result()):
+            _report(trades, result)
+            if result is not None: # Only add to the database if analysis was successful
+                batch.append(result)
+        processed += len(texts)
+        if len(batch) >= insert_batch_size:
+            flush()
+
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as executor:
+        texts = []
+        for trades in trade_offer_list:
+            texts.append(trades)
+            if len(texts) < prompt_batch_size:
+                continue
+            pending.append((texts, executor.submit(analyze_ticket_exchanges, texts)))
+            texts = []
+            if len(pending) >= max_pending:
+                drain_one()
+        if texts:
+            pending.append((texts, executor.submit(analyze_ticket_exchanges, texts)))
+        while pending:
+            drain_one()
+
+    flush()
+    return stored
+
+def _file_size(path):
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return None
+
+def follow(file, poll_interval=DEFAULT_POLL_INTERVAL, record_start=None, **feeder_options):
+    """
+    Watches a growing trades file and ingests new messages as they are appended.
+
+    The file is polled every poll_interval seconds. Only complete lines after
+    the stream's checkpoint are read, so a half written message is picked up
+    on a later poll. With record_start, the last multi-line message is held
+    back until the file has been quiet for one poll, since more continuation
+    lines may still arrive. After each poll that stored trades, the ratio
+    tables are refreshed incrementally so the API serves them right away.
+
+    Runs until interrupted.
+    """
+    stream = MessageStream(file, record_start=record_start, complete_lines=True)
+    last_size = None
+    print(f"Following {file}, polling every {poll_interval:g}s")
+    try:
+        while True:
+            size = _file_size(file)
+            grew = size != last_size
+            last_size = size
+            if size is not None and (grew or record_start is not None):
+                stored = feeder(stream.read(hold_last_record=grew), on_flush=stream.commit, **feeder_options)
+                if stored:
+                    refresh_ratios()
+                    print(f"Stored {stored} new trades and refreshed ratios")
+            time.sleep(poll_interval)
+    except KeyboardInterrupt:
+        print("Stopped following")
+
+def _remove_orphaned_checkpoints(directory):
+    # Left behind when a run stopped between moving a finished file and removing its checkpoint
+    for name in os.listdir(directory):
+        if name.endswith(".checkpoint") and not os.path.exists(os.path.join(directory, name[:-len(".checkpoint")])):
+            os.remove(os.path.join(directory, name))
+
+def follow_spool(directory, poll_interval=DEFAULT_POLL_INTERVAL, record_start=None, **feeder_options):
+    """
+    Watches a spool directory and ingests every file dropped into it.
+
+    Writers should create files under a temporary name (or elsewhere) and
+    rename them into the directory when complete. Each file is read with its
+    own checkpoint, so an interrupted run resumes mid-file, and is then moved
+    to the processed/ subdirectory. Ratios are refreshed once per poll that
+    stored trades.
+
+    Runs until interrupted.
+    """
+    processed_dir = os.path.join(directory, SPOOL_PROCESSED_DIR)
+    os.makedirs(processed_dir, exist_ok=True)
+    _remove_orphaned_checkpoints(directory)
+    print(f"Watching spool directory {directory}, polling every {poll_interval:g}s")
+    try:
+        while True:
+            stored = 0
+            for name in sorted(os.listdir(directory)):
+                path = os.path.join(directory, name)
+                if name.startswith(".") or name.endswith(SPOOL_IGNORED_SUFFIXES) or not os.path.isfile(path):
+                    continue
+                stream = MessageStream(path, record_start=record_start)
+                stored += feeder(stream, on_flush=stream.commit, **feeder_options)
+                # Move the file before forgetting its checkpoint: stopping in between must
+                # not leave a checkpoint-less file to be ingested again from the start
+                os.replace(path, os.path.join(processed_dir, name))
+                stream.reset()
+            if stored:
+                refresh_ratios()
+                print(f"Stored {stored} new trades and refreshed ratios")
+            time.sleep(poll_interval)
+    except KeyboardInterrupt:
+        print("Stopped watching spool directory")
+
+def _parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Extract ticket trades from chat messages and store them.")
+    parser.add_argument("file", nargs="?", default=trades_file, help="Trades file to read (plain or gzip)")
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument("--follow", action="store_true", help="Keep watching the file and ingest appended messages")
+    mode.add_argument("--spool", metavar="DIR", help="Watch a spool directory instead of a single file")
+    parser.add_argument("--poll-interval", type=float, default=DEFAULT_POLL_INTERVAL, help="Seconds between polls")
+    parser.add_argument("--record-start", metavar="REGEX", help="Regex matching the header that starts a multi-line message (the match is dropped)")
+    parser.add_argument("--chat-export", action="store_true", help="Join multi-line chat export posts (timestamped lines)")
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY)
+    parser.add_argument("--prompt-batch-size", type=int, default=DEFAULT_PROMPT_BATCH_SIZE)
+    parser.add_argument("--insert-batch-size", type=int, default=DEFAULT_INSERT_BATCH_SIZE)
+    parser.add_argument("--metrics-port", type=int, help="Record metrics and serve them on http://0.0.0.0:PORT/metrics")
+    return parser.parse_args(argv)
 
 if __name__ == "__main__": #just makes the code only run when ran in the project, not imported as a module
 #     test_texts = [
@@ -140,5 +497,21 @@ if __name__ == "__main__": #just makes the code only run when ran in the project
 # "Hallojs! Byter gärna min 1a maj mot yran",
 # "Byter tre kvalborg mot tre sunwing!"
 #     ]
-    feeder(text_to_list(trades_file))
-    viewdb()
\ No newline at end of file
+    args = _parse_args()
+    if args.metrics_port:
+        metrics.enable()
+        metrics.start_http_server(args.metrics_port)
+    record_start = CHAT_EXPORT_RECORD_START if args.chat_export else args.record_start
+    feeder_options = {
+        "concurrency": args.concurrency,
+        "prompt_batch_size": args.prompt_batch_size,
+        "insert_batch_size": args.insert_batch_size,
+    }
+    if args.spool:
+        follow_spool(args.spool, args.poll_interval, record_start, **feeder_options)
+    elif args.follow:
+        follow(args.file, args.poll_interval, record_start, **feeder_options)
+    else:
+        stream = MessageStream(args.file, record_start=record_start)
+        feeder(stream, on_flush=stream.commit, **feeder_options)
+        viewdb()
\ No newline at end of file
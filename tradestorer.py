@@ -1,13 +1,31 @@
 #LAGRA DE INLÄSTA TRADESEN
 
+import csv
+import json
+import os
 import sqlite3
+import sys
+from itertools import islice
+from database import get_connection
+import tickettypes
+import metrics
 
 # Database interaction
 TRADE_DATABASE_NAME = 'ticket_trades.db'
 
-def create_trades_table():
-    conn = sqlite3.connect(TRADE_DATABASE_NAME)
-    cursor = conn.cursor()
+DEFAULT_CHUNK_SIZE = 1000 # Rows per executemany call in bulk inserts
+
+# Column order used by the bulk insert path; timestamp and dedupe_key are optional
+TRADE_COLUMNS = ("offered_quantity", "offered_ticket_type", "requested_quantity",
+                 "requested_ticket_type", "timestamp", "dedupe_key")
+
+# --- Schema Migrations ---
+# Each migration runs once, in order, and is recorded in schema_version.
+# They are written to be safe on databases created before schema_version
+# existed (which start at version 0), so every step tolerates objects that
+# are already there.
+
+def _migration_base_tables(cursor):
     cursor.execute("""
         CREATE TABLE IF NOT EXISTS ticket_trades (
             offered_quantity INTEGER,
@@ -17,27 +35,331 @@ def create_trades_table():
             timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
         )
     """)
-    conn.commit()
-    conn.close()
+    # Running per-pair totals maintained incrementally by ratiocalc.
+    # type1/type2 is the alphabetically sorted (cleaned) pair of ticket types.
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS pair_exchange_stats (
+            type1 TEXT,
+            type2 TEXT,
+            total_type1_exchanged INTEGER NOT NULL DEFAULT 0,
+            total_type2_exchanged INTEGER NOT NULL DEFAULT 0,
+            trade_count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (type1, type2)
+        )
+    """)
+    # High-water mark: the last ticket_trades rowid folded into the pair aggregates
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS pair_stats_state (
+            id INTEGER PRIMARY KEY CHECK (id = 0),
+            last_rowid INTEGER NOT NULL
+        )
+    """)
+    cursor.execute("INSERT OR IGNORE INTO pair_stats_state (id, last_rowid) VALUES (0, 0)")
 
-def add_trade_entry(offered_quantity, offered_ticket_type, requested_quantity, requested_ticket_type):
-    conn = sqlite3.connect(TRADE_DATABASE_NAME)
-    cursor = conn.cursor()
+def _migration_pair_buckets(cursor):
+    # The same totals split into time buckets (bucket_start is epoch seconds), used for
+    # rolling-window and decay-weighted ratios
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS pair_exchange_buckets (
+            bucket_start INTEGER,
+            type1 TEXT,
+            type2 TEXT,
+            total_type1_exchanged INTEGER NOT NULL DEFAULT 0,
+            total_type2_exchanged INTEGER NOT NULL DEFAULT 0,
+            trade_count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (bucket_start, type1, type2)
+        )
+    """)
+    # Existing all-time totals have no bucket breakdown, rebuild both on the next run
+    reset_pair_stats(cursor)
+
+def _migration_dedupe_key(cursor):
+    # Optional caller-supplied key (e.g. a message hash) that makes re-imports idempotent.
+    # UNIQUE still allows any number of NULLs, so rows without a key are never deduplicated.
+    cursor.execute("PRAGMA table_info(ticket_trades)")
+    if "dedupe_key" not in [row[1] for row in cursor.fetchall()]:
+        cursor.execute("ALTER TABLE ticket_trades ADD COLUMN dedupe_key TEXT")
+
+def _migration_primary_key_and_indexes(cursor):
+    # Rebuild ticket_trades with an explicit integer primary key. Old rowids are kept as ids,
+    # so the pair_stats_state high-water mark stays valid. AUTOINCREMENT guarantees ids are
+    # never reused after deletes, which the high-water mark relies on.
+    cursor.execute("DROP TABLE IF EXISTS ticket_trades_new")
     cursor.execute("""
-        INSERT INTO ticket_trades (offered_quantity, offered_ticket_type, requested_quantity, requested_ticket_type)
-        VALUES (?, ?, ?, ?)
-    """, (offered_quantity, offered_ticket_type, requested_quantity, requested_ticket_type))
-    conn.commit()
-    conn.close()
+        CREATE TABLE ticket_trades_new (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            offered_quantity INTEGER,
+            offered_ticket_type TEXT,
+            requested_quantity INTEGER,
+            requested_ticket_type TEXT,
+            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+            dedupe_key TEXT
+        )
+    """)
+    cursor.execute("""
+        INSERT INTO ticket_trades_new
+            (id, offered_quantity, offered_ticket_type, requested_quantity, requested_ticket_type, timestamp, dedupe_key)
+        SELECT rowid, offered_quantity, offered_ticket_type, requested_quantity, requested_ticket_type, timestamp, dedupe_key
+        FROM ticket_trades
+    """)
+    cursor.execute("DROP TABLE ticket_trades")
+    cursor.execute("ALTER TABLE ticket_trades_new RENAME TO ticket_trades")
+    cursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_ticket_trades_dedupe_key ON ticket_trades (dedupe_key)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_ticket_trades_offered_type ON ticket_trades (offered_ticket_type)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_ticket_trades_requested_type ON ticket_trades (requested_ticket_type)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_ticket_trades_timestamp ON ticket_trades (timestamp)")
+
+    # Lookup table giving every ticket type string a small integer id,
+    # kept complete by a trigger on every insert path
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS ticket_types (
+            id INTEGER PRIMARY KEY,
+            name TEXT NOT NULL UNIQUE
+        )
+    """)
+    cursor.execute("""
+        INSERT OR IGNORE INTO ticket_types (name)
+        SELECT offered_ticket_type FROM ticket_trades WHERE offered_ticket_type IS NOT NULL
+        UNION
+        SELECT requested_ticket_type FROM ticket_trades WHERE requested_ticket_type IS NOT NULL
+    """)
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_ticket_trades_types AFTER INSERT ON ticket_trades
+        BEGIN
+            INSERT OR IGNORE INTO ticket_types (name)
+            SELECT NEW.offered_ticket_type WHERE NEW.offered_ticket_type IS NOT NULL;
+            INSERT OR IGNORE INTO ticket_types (name)
+            SELECT NEW.requested_ticket_type WHERE NEW.requested_ticket_type IS NOT NULL;
+        END
+    """)
+
+def _migration_canonical_ticket_types(cursor):
+    # Store every known ticket type under its canonical registry name ("T-bar" -> "T-Bar"),
+    # which is what add_trade_entries writes from now on. Unknown types are left as they are.
+    for column in ("offered_ticket_type", "requested_ticket_type"):
+        cursor.execute(f"SELECT DISTINCT {column} FROM ticket_trades WHERE {column} IS NOT NULL")
+        renames = [(tickettypes.normalize(name), name) for (name,) in cursor.fetchall()]
+        cursor.executemany(f"UPDATE ticket_trades SET {column} = ? WHERE {column} = ?",
+                           [(canonical, name) for canonical, name in renames if canonical is not None and canonical != name])
+
+    # Number the canonical types first, in registry order; other names seen in the trades follow after them
+    cursor.execute("DELETE FROM ticket_types")
+    cursor.executemany("INSERT INTO ticket_types (id, name) VALUES (?, ?)",
+                       list(enumerate(tickettypes.TICKET_TYPES, start=1)))
+    cursor.execute("""
+        INSERT OR IGNORE INTO ticket_types (name)
+        SELECT offered_ticket_type FROM ticket_trades WHERE offered_ticket_type IS NOT NULL
+        UNION
+        SELECT requested_ticket_type FROM ticket_trades WHERE requested_ticket_type IS NOT NULL
+    """)
+    # The aggregates were keyed by ratiocalc's old uppercased names, rebuild them
+    reset_pair_stats(cursor)
+
+SCHEMA_MIGRATIONS = [
+    (1, _migration_base_tables),
+    (2, _migration_pair_buckets),
+    (3, _migration_dedupe_key),
+    (4, _migration_primary_key_and_indexes),
+    (5, _migration_canonical_ticket_types),
+]
+
+_schema_ready = set() # Absolute paths of trade databases this process has checked or migrated
+
+def create_trades_table():
+    """
+    Creates the trade tables, or upgrades an existing database by running
+    every migration newer than its recorded schema_version.
+    """
+    conn = get_connection(TRADE_DATABASE_NAME)
+    cursor = conn.cursor()
+    cursor.execute("CREATE TABLE IF NOT EXISTS schema_version (version INTEGER NOT NULL)")
+    cursor.execute("SELECT version FROM schema_version")
+    row = cursor.fetchone()
+    if row is not None and row[0] >= SCHEMA_MIGRATIONS[-1][0]:
+        _schema_ready.add(os.path.abspath(TRADE_DATABASE_NAME))
+        return # Already current, the common case at startup
+
+    try:
+        # Take the write lock first so concurrent processes migrate one at a time,
+        # then re-read the version another process may have just bumped
+        cursor.execute("BEGIN IMMEDIATE")
+        cursor.execute("SELECT version FROM schema_version")
+        row = cursor.fetchone()
+        current_version = row[0] if row is not None else 0
+        for version, migration in SCHEMA_MIGRATIONS:
+            if version > current_version:
+                migration(cursor)
+                print(f"Applied schema migration {version}: {migration.__name__}")
+        cursor.execute("DELETE FROM schema_version")
+        cursor.execute("INSERT INTO schema_version (version) VALUES (?)", (SCHEMA_MIGRATIONS[-1][0],))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    _schema_ready.add(os.path.abspath(TRADE_DATABASE_NAME))
+
+def get_trades_connection():
+    """
+    Returns this thread's connection to the trade database, creating or
+    upgrading the schema the first time this process uses that database file,
+    so merely importing the module never touches the database.
+    """
+    if os.path.abspath(TRADE_DATABASE_NAME) not in _schema_ready:
+        create_trades_table()
+    return get_connection(TRADE_DATABASE_NAME)
+
+def reset_pair_stats(cursor):
+    """
+    Clears the incremental pair aggregates so the next ratio calculation
+    rebuilds them from scratch. Must be called in the same transaction as any
+    change to ticket_trades that is not a plain append (deletes, edits).
+    """
+    cursor.execute("DELETE FROM pair_exchange_stats")
+    cursor.execute("DELETE FROM pair_exchange_buckets")
+    cursor.execute("UPDATE pair_stats_state SET last_rowid = 0")
+
+def add_trade_entry(offered_quantity, offered_ticket_type, requested_quantity, requested_ticket_type):
+    """
+    Inserts one trade, with the same rules as add_trade_entries: ticket types
+    are stored under their canonical name, and a trade with a type the
+    registry doesn't know is skipped with a warning.
+
+    Returns:
+        bool: True if the trade was inserted.
+    """
+    row = _trade_row((offered_quantity, offered_ticket_type, requested_quantity, requested_ticket_type))
+    if row is None:
+        return False
+    conn = get_trades_connection()
+    try:
+        cursor = conn.cursor()
+        with metrics.timer("db_query_seconds", operation="insert_trade"):
+            cursor.execute("""
+                INSERT INTO ticket_trades (offered_quantity, offered_ticket_type, requested_quantity, requested_ticket_type)
+                VALUES (?, ?, ?, ?)
+            """, row[:4])
+            conn.commit()
+        return True
+    except Exception:
+        conn.rollback() # The connection is reused, don't leave a half-open transaction on it
+        raise
+
+def _quantity(value):
+    """Returns value as an int if it is a whole number (int, integral float or digit string), otherwise None."""
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, float):
+        return int(value) if value.is_integer() else None
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+def _trade_row(entry, dedupe_key=None):
+    """
+    Normalizes a tuple or dict trade into the TRADE_COLUMNS order, with both
+    ticket types in their canonical form. Returns None for a trade that can't
+    be stored (unknown type or malformed quantity), so one bad row is skipped
+    instead of aborting the whole import.
+    """
+    if isinstance(entry, dict):
+        row = [entry.get(column) for column in TRADE_COLUMNS]
+    else:
+        row = list(entry) + [None] * (len(TRADE_COLUMNS) - len(entry))
+    offered_quantity = _quantity(row[0])
+    requested_quantity = _quantity(row[2])
+    if offered_quantity is None or requested_quantity is None:
+        print(f"Warning: Skipping trade with malformed quantity: {row[0]!r} {row[1]} -> {row[2]!r} {row[3]}")
+        metrics.inc("trades_skipped_total", reason="bad_quantity")
+        return None
+    row[0] = offered_quantity
+    row[2] = requested_quantity
+    offered_ticket_type = tickettypes.normalize(row[1])
+    requested_ticket_type = tickettypes.normalize(row[3])
+    if offered_ticket_type is None or requested_ticket_type is None:
+        print(f"Warning: Skipping trade with unknown ticket type: {row[0]} {row[1]} -> {row[2]} {row[3]}")
+        metrics.inc("trades_skipped_total", reason="unknown_type")
+        return None
+    row[1] = offered_ticket_type
+    row[3] = requested_ticket_type
+    for index in (4, 5): # Blank CSV cells mean "not given", like a missing key
+        if isinstance(row[index], str) and not row[index].strip():
+            row[index] = None
+    if row[5] is None and dedupe_key is not None:
+        row[5] = dedupe_key(row)
+    return row
+
+def add_trade_entries(entries, chunk_size=DEFAULT_CHUNK_SIZE, dedupe_key=None):
+    """
+    Inserts many trades in a single transaction.
+
+    Rows are streamed into executemany in chunks of chunk_size, so arbitrarily
+    large iterables never have to be held in memory. Ticket types are stored
+    under their canonical tickettypes name; trades with a type the registry
+    doesn't know or a quantity that isn't a whole number, and rows whose
+    dedupe_key already exists in the table, are skipped.
+
+    Args:
+        entries (iterable): Trades as tuples in TRADE_COLUMNS order (the last
+                            two, timestamp and dedupe_key, may be left out) or
+                            dicts keyed by column name. A missing timestamp
+                            defaults to the current time.
+        chunk_size (int): Rows per executemany call.
+        dedupe_key (callable): Optional function computing a dedupe key from a
+                               normalized row when the entry doesn't carry one.
+
+    Returns:
+        int: Number of rows inserted.
+    """
+    rows = filter(None, (_trade_row(entry, dedupe_key) for entry in entries))
+    conn = get_trades_connection()
+    inserted = 0
+    try:
+        cursor = conn.cursor()
+        with metrics.timer("db_query_seconds", operation="insert_trades"):
+            while True:
+                chunk = list(islice(rows, chunk_size))
+                if not chunk:
+                    break
+                cursor.executemany("""
+                    INSERT OR IGNORE INTO ticket_trades
+                        (offered_quantity, offered_ticket_type, requested_quantity, requested_ticket_type, timestamp, dedupe_key)
+                    VALUES (?, ?, ?, ?, COALESCE(?, CURRENT_TIMESTAMP), ?)
+                """, chunk)
+                # rowcount counts only the rows this statement inserted; total_changes
+                # would also count the ticket_types rows added by the insert trigger
+                inserted += cursor.rowcount
+            conn.commit()
+        return inserted
+    except Exception:
+        conn.rollback()
+        raise
+
+def import_trades_csv(path, **kwargs):
+    """
+    Bulk-loads trades from a CSV file with a header row naming TRADE_COLUMNS.
+    Keyword arguments are passed on to add_trade_entries.
+    """
+    with open(path, newline='', encoding='utf-8') as file:
+        return add_trade_entries(csv.DictReader(file), **kwargs)
+
+def import_trades_jsonl(path, **kwargs):
+    """
+    Bulk-loads trades from a JSON Lines file, one object keyed by TRADE_COLUMNS per line.
+    Keyword arguments are passed on to add_trade_entries.
+    """
+    with open(path, encoding='utf-8') as file:
+        return add_trade_entries((json.loads(line) for line in file if line.strip()), **kwargs)
 
 def remove_trade_entry(ticket_type):
     """
     Removes all entries from the ticket_trades table where either
-    offered_ticket_type or requested_ticket_type is 'type'.
+    offered_ticket_type or requested_ticket_type is 'type' (any spelling).
     """
+    ticket_type = tickettypes.normalize(ticket_type) or ticket_type
     conn = None
     try:
-        conn = sqlite3.connect(TRADE_DATABASE_NAME)
+        conn = get_trades_connection()
         cursor = conn.cursor()
 
         # SQL statement to delete entries
@@ -46,9 +368,13 @@ def remove_trade_entry(ticket_type):
             WHERE offered_ticket_type = ? OR requested_ticket_type = ?
         """
         cursor.execute(sql_delete, (ticket_type, ticket_type))  # Use parameter binding
+        removed = cursor.rowcount
+        if removed > 0:
+            # Aggregates can't be decremented from the rowid high-water mark, rebuild them next run
+            reset_pair_stats(cursor)
         conn.commit()
 
-        print(f"Removed {cursor.rowcount} entries containing '{ticket_type}'.")
+        print(f"Removed {removed} entries containing '{ticket_type}'.")
 
     except sqlite3.Error as e:
         print(f"Database error during deletion: {e}")
@@ -58,24 +384,24 @@ def remove_trade_entry(ticket_type):
         print(f"An unexpected error occurred: {e}")
         if conn:
             conn.rollback()
-    finally:
-        if conn:
-            conn.close()
 
 def viewdb():
-    conn = sqlite3.connect(TRADE_DATABASE_NAME)
+    conn = get_trades_connection()
     cursor = conn.cursor()
     cursor.execute("SELECT * FROM ticket_trades")
     rows = cursor.fetchall()
     for row in rows:
         print(row)
-    conn.close()
-
 
-create_trades_table() #Creates table if it doesn't already exist
 
 if __name__ == "__main__":
-    #add_trade_entry(2, "NSA", 3, "ÖG")
-    remove_trade_entry("Sydskånska")
-    viewdb()
+    if len(sys.argv) > 2 and sys.argv[1] == "import":
+        # python tradestorer.py import trades.csv more_trades.jsonl
+        for path in sys.argv[2:]:
+            importer = import_trades_jsonl if path.endswith((".jsonl", ".json")) else import_trades_csv
+            print(f"Imported {importer(path)} trades from {path}")
+    else:
+        #add_trade_entry(2, "NSA", 3, "ÖG")
+        remove_trade_entry("Sydskånska")
+        viewdb()
 